@@ -3,33 +3,267 @@ Smart Attendance System - Complete Backend
 Flask server with SQLite, Face Recognition, and all API endpoints
 """
 
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template, g, has_app_context, abort
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
 import jwt
 import datetime
+import logging
 import os
 import base64
 import random
 import string
-import cv2
-import numpy as np
-import face_recognition
-from functools import wraps
-from io import BytesIO
+import threading
+import json
+import time
+import secrets
+import zipfile
+import click
+import multiprocessing
+from functools import wraps, partial
+from worker_pool import BoundedProcessPool, PoolBusyError, JobTimeoutError
+from face_engine import (FACE_STACK_MODULES, FaceValidationError, encode_single_face, encode_all_faces,
+                         load_face_stack, warm_up as warm_up_face_engine)
+from face_store import encode_face, match_group
+from encoding_store import SharedEncodingStore
+from migrations import run_migrations, check_query_plans
+from pubsub import Broker
+from session_registry import ActiveSessionRegistry
+from summaries import (session_started, attendance_marked,
+                       student_removed, rebuild_summaries, rebuild_entity_counts)
+from bulk_import import (IMPORT_KINDS, BulkImportError, parse_csv, normalize_rows,
+                         hash_in_pool, import_students, import_teachers)
+from enrollment import EnrollmentRunner, create_job, claim_job, job_status
+from attendance_queue import AttendanceQueue, enqueue_job, job_status as attendance_job_status
+from identity import TokenCache, IdentityCache
+from passwords import hash_password, verify_password
+from metrics import Registry
+from db_writer import GroupCommitWriter, WriteTimeoutError
+from session_scheduler import SessionScheduler, close_sessions
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
-app.config['DATABASE'] = 'database/attendance.db'
+app.config['DATABASE'] = os.environ.get('DATABASE', 'database/attendance.db')
+app.config['FACE_POOL_WORKERS'] = int(os.environ.get('FACE_POOL_WORKERS', os.cpu_count() or 1))
+app.config['FACE_POOL_QUEUE'] = int(os.environ.get('FACE_POOL_QUEUE', 2 * app.config['FACE_POOL_WORKERS']))
+app.config['FACE_JOB_TIMEOUT'] = float(os.environ.get('FACE_JOB_TIMEOUT', 30))
+app.config['FACE_POOL_RETRY_AFTER'] = int(os.environ.get('FACE_POOL_RETRY_AFTER', 2))
+app.config['FACE_ENCODING_DTYPE'] = os.environ.get('FACE_ENCODING_DTYPE', 'float32')
+app.config['FACE_MATCH_TOLERANCE'] = float(os.environ.get('FACE_MATCH_TOLERANCE', 0.4))
+app.config['ENCODING_STORE_PATH'] = os.environ.get(
+    'ENCODING_STORE_PATH', os.path.join(os.path.dirname(app.config['DATABASE']), 'encodings'))
+app.config['FACE_AMBIGUITY_MARGIN'] = float(os.environ.get('FACE_AMBIGUITY_MARGIN', 0.05))
+app.config['GROUP_PHOTO_MAX_IMAGES'] = int(os.environ.get('GROUP_PHOTO_MAX_IMAGES', 5))
+app.config['FACE_UPLOAD_MAX_BYTES'] = int(os.environ.get('FACE_UPLOAD_MAX_BYTES', 10 * 1024 * 1024))
+app.config['FACE_DETECTION_MAX_DIMENSION'] = int(os.environ.get('FACE_DETECTION_MAX_DIMENSION', 640))
+app.config['GROUP_PHOTO_MAX_DIMENSION'] = int(os.environ.get('GROUP_PHOTO_MAX_DIMENSION', 1600))
+app.config['FACE_DETECTION_MODEL'] = os.environ.get('FACE_DETECTION_MODEL', 'hog')
+app.config['FACE_DETECTION_UPSAMPLE'] = int(os.environ.get('FACE_DETECTION_UPSAMPLE', 1))
+app.config['FACE_ENCODING_JITTERS'] = int(os.environ.get('FACE_ENCODING_JITTERS', 1))
+app.config['FACE_TIMING_LOG'] = os.environ.get('FACE_TIMING_LOG', '0') == '1'
+app.config['FACE_BACKEND'] = os.environ.get('FACE_BACKEND', 'face_recognition')
+app.config['FACE_POOL_START_METHOD'] = os.environ.get(
+    'FACE_POOL_START_METHOD',
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('DB_BUSY_TIMEOUT_MS', 5000))
+app.config['WRITE_BATCH_MAX'] = int(os.environ.get('WRITE_BATCH_MAX', 64))
+app.config['WRITE_BATCH_DELAY_MS'] = float(os.environ.get('WRITE_BATCH_DELAY_MS', 2))
+app.config['WRITE_TIMEOUT_SECONDS'] = float(os.environ.get('WRITE_TIMEOUT_SECONDS', 15))
+app.config['DB_STATEMENT_CACHE'] = int(os.environ.get('DB_STATEMENT_CACHE', 256))
+app.config['DB_SLOW_QUERY_MS'] = float(os.environ.get('DB_SLOW_QUERY_MS', 200))
+app.config['ATTENDANCE_STREAM_RESYNC_SECONDS'] = float(os.environ.get('ATTENDANCE_STREAM_RESYNC_SECONDS', 5))
+app.config['ATTENDANCE_STREAM_MAX_SECONDS'] = float(os.environ.get('ATTENDANCE_STREAM_MAX_SECONDS', 300))
+app.config['ATTENDANCE_STREAM_MAX_PER_WORKER'] = int(os.environ.get('ATTENDANCE_STREAM_MAX_PER_WORKER', 2))
+app.config['ATTENDANCE_STREAM_TICKET_SECONDS'] = int(os.environ.get('ATTENDANCE_STREAM_TICKET_SECONDS', 30))
+app.config['SESSION_DURATION_SECONDS'] = int(os.environ.get('SESSION_DURATION_SECONDS', 60))
+app.config['SESSION_SUBMIT_GRACE_SECONDS'] = int(os.environ.get('SESSION_SUBMIT_GRACE_SECONDS', 10))
+app.config['SESSION_SCHEDULER_INTERVAL_SECONDS'] = float(os.environ.get('SESSION_SCHEDULER_INTERVAL_SECONDS', 1))
+app.config['SESSION_CLOSE_BATCH'] = int(os.environ.get('SESSION_CLOSE_BATCH', 100))
+# Threads per process verifying queued attendance selfies (Prefer: respond-async)
+app.config['ATTENDANCE_QUEUE_WORKERS'] = int(os.environ.get('ATTENDANCE_QUEUE_WORKERS', app.config['FACE_POOL_WORKERS']))
+app.config['ATTENDANCE_JOB_RETENTION_SECONDS'] = float(os.environ.get('ATTENDANCE_JOB_RETENTION_SECONDS', 3600))
+app.config['REPORT_FROM_COUNTERS'] = os.environ.get('REPORT_FROM_COUNTERS', '1') == '1'
+app.config['REPORT_MAX_SESSIONS'] = int(os.environ.get('REPORT_MAX_SESSIONS', 500))
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', '')
+app.config['PASSWORD_POOL_WORKERS'] = int(os.environ.get('PASSWORD_POOL_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_POOL_QUEUE'] = int(os.environ.get('PASSWORD_POOL_QUEUE', 8 * app.config['PASSWORD_POOL_WORKERS']))
+app.config['PASSWORD_JOB_TIMEOUT'] = float(os.environ.get('PASSWORD_JOB_TIMEOUT', 60))
+app.config['IMPORT_MAX_ROWS'] = int(os.environ.get('IMPORT_MAX_ROWS', 5000))
+app.config['IMPORT_CHUNK_SIZE'] = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+app.config['IMPORT_HASH_BATCH'] = int(os.environ.get('IMPORT_HASH_BATCH', 32))
+app.config['ENROLLMENT_DIR'] = os.environ.get('ENROLLMENT_DIR', 'database/enrollment')
+app.config['ENROLLMENT_POOL_WORKERS'] = int(os.environ.get('ENROLLMENT_POOL_WORKERS', os.cpu_count() or 1))
+app.config['ENROLLMENT_BATCH_SIZE'] = int(os.environ.get('ENROLLMENT_BATCH_SIZE', 50))
+app.config['ENROLLMENT_CHECKPOINT_SECONDS'] = float(os.environ.get('ENROLLMENT_CHECKPOINT_SECONDS', 5))
+app.config['ENROLLMENT_STALE_SECONDS'] = float(os.environ.get('ENROLLMENT_STALE_SECONDS', 60))
+app.config['ENROLLMENT_MAX_IMAGE_BYTES'] = int(os.environ.get('ENROLLMENT_MAX_IMAGE_BYTES', 10 * 1024 * 1024))
+app.config['IDENTITY_CACHE_TTL'] = float(os.environ.get('IDENTITY_CACHE_TTL', 60))
+app.config['TOKEN_CACHE_SIZE'] = int(os.environ.get('TOKEN_CACHE_SIZE', 10000))
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '0') == '1'
 CORS(app)
 
-# Create necessary directories
-for dir_path in ['database', 'static/faces', 'static/models']:
-    try:
-        os.makedirs(dir_path, exist_ok=True)
-    except FileExistsError:
-        print(f"Warning: '{dir_path}' exists as a file. Please remove it to allow directory creation.")
+if app.config['FACE_TIMING_LOG']:
+    app.logger.setLevel(logging.INFO)
+
+# Face pool workers load the face stack when they start. With 'forkserver'
+# each web process's fork server imports it once and that process's pool
+# workers share the copy, so gunicorn holds one copy per worker; only with
+# 'fork' do all of them share what the preloading master loaded (see warm_up)
+face_pool_options = {
+    'start_method': app.config['FACE_POOL_START_METHOD'],
+    'initializer': partial(warm_up_face_engine, app.config['FACE_BACKEND']),
+    'preload': FACE_STACK_MODULES if app.config['FACE_BACKEND'] != 'stub' else ()
+}
+
+# Face detection/encoding runs in its own processes so that dlib work never
+# occupies the gunicorn request threads serving login, verify-code and polling
+face_pool = BoundedProcessPool(
+    max_workers=app.config['FACE_POOL_WORKERS'],
+    max_queue=app.config['FACE_POOL_QUEUE'],
+    timeout=app.config['FACE_JOB_TIMEOUT'],
+    retry_after=app.config['FACE_POOL_RETRY_AFTER'],
+    **face_pool_options
+)
+
+# Password hashing is deliberately slow; logins and bulk imports hash and
+# verify in their own pool so a login storm cannot tie up request threads
+password_pool = BoundedProcessPool(
+    max_workers=app.config['PASSWORD_POOL_WORKERS'],
+    max_queue=app.config['PASSWORD_POOL_QUEUE'],
+    timeout=app.config['PASSWORD_JOB_TIMEOUT'],
+    retry_after=app.config['FACE_POOL_RETRY_AFTER']
+)
+
+# Bulk enrollment gets its own pool so students registering or marking
+# attendance are not queued behind an archive of thousands of photos
+enrollment_pool = BoundedProcessPool(
+    max_workers=app.config['ENROLLMENT_POOL_WORKERS'],
+    timeout=app.config['FACE_JOB_TIMEOUT'],
+    retry_after=app.config['FACE_POOL_RETRY_AFTER'],
+    **face_pool_options
+)
+
+# ============================================
+# METRICS
+# ============================================
+
+# Disabled registries ignore every update, so instrumentation is close to
+# free unless METRICS_ENABLED is set
+metrics = Registry(enabled=app.config['METRICS_ENABLED'])
+
+request_latency = metrics.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint, method and status',
+    ('endpoint', 'method', 'status'))
+face_stage_latency = metrics.histogram(
+    'face_stage_duration_seconds',
+    'Time spent in each stage of face registration and attendance marking', ('endpoint', 'stage'))
+db_query_latency = metrics.histogram(
+    'db_query_duration_seconds', 'Execution time of query_db calls by statement type', ('statement',))
+slow_queries = metrics.counter('db_slow_queries_total', 'query_db calls slower than DB_SLOW_QUERY_MS')
+write_batch_size = metrics.histogram(
+    'db_write_batch_size', 'Write operations committed per group-commit transaction',
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+write_batch_latency = metrics.histogram(
+    'db_write_batch_duration_seconds', 'Time from BEGIN to COMMIT of each group-commit transaction')
+
+worker_pools = {'face': face_pool, 'password': password_pool, 'enrollment': enrollment_pool}
+metrics.gauge('worker_pool_pending_jobs', 'Jobs queued or running in each process pool',
+              lambda: {(name,): pool.pending for name, pool in worker_pools.items()}, ('pool',))
+metrics.gauge('worker_pool_capacity', 'Jobs each process pool admits before answering 503',
+              lambda: {(name,): pool.max_workers + pool.max_queue for name, pool in worker_pools.items()},
+              ('pool',))
+metrics.gauge('db_writer_pending', 'Write operations queued for the group-commit writer',
+              lambda: db_writer.pending)
+metrics.gauge('active_sessions', 'Sessions held in the in-memory registry (running or in their grace period)',
+              lambda: len(active_sessions))
+metrics.gauge('encoding_store_generation', 'Generation of the shared encoding store mapped by this process',
+              lambda: encoding_store.generation)
+metrics.gauge('attendance_jobs_pending', 'Queued attendance selfies waiting for a worker (all processes)',
+              lambda: query_db("SELECT COUNT(*) AS n FROM attendance_jobs WHERE status = 'pending'", one=True)['n'])
+metrics.gauge('attendance_stream_subscribers', 'Open live attendance streams',
+              lambda: attendance_events.subscriber_count())
+
+@app.before_request
+def start_request_timer():
+    if metrics.enabled:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        request_latency.observe(time.perf_counter() - started, request.endpoint or 'unmatched',
+                                request.method, str(response.status_code))
+    return response
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.enabled:
+        return jsonify({'message': 'Metrics are disabled'}), 404
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# ============================================
+# DATABASE CONNECTIONS
+# ============================================
+
+def connect_db():
+    """Open a connection in WAL mode with the pragmas used by every request"""
+    conn = sqlite3.connect(
+        app.config['DATABASE'],
+        timeout=app.config['DB_BUSY_TIMEOUT_MS'] / 1000,
+        cached_statements=app.config['DB_STATEMENT_CACHE']
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute(f"PRAGMA busy_timeout = {app.config['DB_BUSY_TIMEOUT_MS']}")
+    return conn
+
+# One persistent connection per thread (gunicorn threads are long-lived), so
+# requests reuse the connection and its prepared-statement cache
+_db_local = threading.local()
+
+def get_db():
+    """Return the calling thread's connection, opening it on first use"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None or _db_local.pid != os.getpid():
+        conn = connect_db()
+        _db_local.conn = conn
+        _db_local.pid = os.getpid()
+    if has_app_context():
+        g.db_used = True
+    return conn
+
+@app.teardown_appcontext
+def release_db(exception):
+    """Roll back anything a request left uncommitted on its thread's connection"""
+    if g.pop('db_used', False):
+        conn = getattr(_db_local, 'conn', None)
+        if conn is not None and conn.in_transaction:
+            conn.rollback()
+
+def close_db():
+    """Close the calling thread's connection, e.g. before the process forks"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is not None:
+        _db_local.conn = None
+        conn.close()
+
+def record_write_batch(size, seconds):
+    write_batch_size.observe(size)
+    write_batch_latency.observe(seconds)
+
+# Attendance and session writes go through one writer thread per process,
+# which commits whatever is queued together instead of one commit per request
+db_writer = GroupCommitWriter(
+    connect_db,
+    max_batch=app.config['WRITE_BATCH_MAX'],
+    max_delay=app.config['WRITE_BATCH_DELAY_MS'] / 1000,
+    on_batch=record_write_batch,
+    timeout=app.config['WRITE_TIMEOUT_SECONDS']
+)
 
 # ============================================
 # DATABASE INITIALIZATION
@@ -37,7 +271,7 @@ for dir_path in ['database', 'static/faces', 'static/models']:
 
 def init_db():
     """Initialize database with all required tables"""
-    conn = sqlite3.connect(app.config['DATABASE'])
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Users table (admin, teachers, students)
@@ -78,7 +312,7 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
             class_id INTEGER NOT NULL,
-            face_encoding TEXT,
+            face_encoding BLOB,
             face_registered BOOLEAN DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
             FOREIGN KEY (class_id) REFERENCES classes(id) ON DELETE CASCADE
@@ -137,10 +371,15 @@ def init_db():
         )
     ''')
     
+    conn.commit()
+    
+    # Apply versioned schema changes (indexes, constraints, data migrations)
+    run_migrations(conn, app.config)
+    
     # Create default admin
     cursor.execute("SELECT * FROM users WHERE email = ?", ('admin@smart.edu',))
     if not cursor.fetchone():
-        hashed_password = generate_password_hash('admin123')
+        hashed_password = hash_password('admin123', app.config['PASSWORD_HASH_METHOD'])
         cursor.execute(
             "INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, ?)",
             ('admin@smart.edu', hashed_password, 'Admin', 'admin')
@@ -149,8 +388,53 @@ def init_db():
     conn.commit()
     conn.close()
 
-# Initialize database on startup
-init_db()
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a hot query no longer uses its index"""
+    startup()
+    failures = check_query_plans(get_db())
+    for query, plan in failures:
+        print(f'NOT INDEXED: {query}\n    plan: {plan}')
+    if failures:
+        raise SystemExit(1)
+    print('All hot queries use their indexes')
+
+@app.cli.command('rebuild-summaries')
+def rebuild_summaries_command():
+    """Recompute the attendance summary tables and admin row counts from scratch"""
+    startup()
+    conn = get_db()
+    conn.execute('BEGIN IMMEDIATE')
+    rebuild_summaries(conn)
+    rebuild_entity_counts(conn)
+    conn.commit()
+    print('Attendance summaries rebuilt')
+
+@app.cli.command('enroll-faces')
+@click.argument('source', required=False)
+@click.option('--resume', 'resume_id', type=int, help='Continue an interrupted job')
+def enroll_faces_command(source, resume_id):
+    """Enroll faces from a zip or directory of photos named by email or student id"""
+    startup()
+    conn = get_db()
+    if resume_id is None:
+        if not source:
+            raise click.UsageError('Give a SOURCE path or --resume JOB_ID')
+        try:
+            job_id = create_job(conn, source)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    else:
+        job_id = resume_id
+    if not claim_job(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS']):
+        raise click.ClickException(f'Job {job_id} is running or already completed')
+    
+    print(f'Enrollment job {job_id} started')
+    enrollment_runner().run(job_id)
+    status = job_status(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS'])
+    enrollment_pool.shutdown()
+    print(f"Enrolled {status['enrolled']}, failed {status['failed']}, skipped {status['skipped']} "
+          f"({status['images_per_second']} images/sec)")
 
 # ============================================
 # AUTHENTICATION MIDDLEWARE
@@ -163,16 +447,65 @@ def token_required(f):
         if not token:
             return jsonify({'message': 'Token is missing'}), 401
         
-        try:
-            token = token.replace('Bearer ', '')
-            data = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            current_user = data
-        except:
+        token = token.replace('Bearer ', '')
+        claims = token_cache.get(token)
+        if claims is None:
+            try:
+                claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+            except:
+                return jsonify({'message': 'Token is invalid'}), 401
+            token_cache.put(token, claims)
+        
+        current_user = resolve_user(claims)
+        if current_user is None:
             return jsonify({'message': 'Token is invalid'}), 401
         
         return f(current_user, *args, **kwargs)
     return decorated
 
+def stream_ticket_required(f):
+    """token_required for a session's live stream.
+
+    EventSource cannot send headers, so instead of the login token the URL
+    carries a short-lived ticket valid only for this session's stream
+    (see attendance_stream_ticket), which is harmless once it shows up in
+    access logs.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        try:
+            claims = jwt.decode(request.args.get('ticket', ''), app.config['SECRET_KEY'], algorithms=['HS256'])
+        except jwt.PyJWTError:
+            return jsonify({'message': 'Ticket is invalid'}), 401
+        if claims.get('purpose') != 'attendance-stream' or claims.get('session_id') != kwargs.get('session_id'):
+            return jsonify({'message': 'Ticket is invalid'}), 401
+        current_user = resolve_user(claims)
+        if current_user is None:
+            return jsonify({'message': 'Ticket is invalid'}), 401
+        
+        return f(current_user, *args, **kwargs)
+    return decorated
+
+def resolve_user(claims):
+    """Claims plus the resolved teacher/student ids and class, so handlers need no lookup"""
+    identity = identities.get(claims['user_id'])
+    if identity is None:
+        return None
+    return dict(claims, **identity)
+
+def load_identity(user_id):
+    return query_db('''
+        SELECT u.id as user_id, u.role, u.name, u.email,
+               t.id as teacher_id, s.id as student_id, s.class_id
+        FROM users u
+        LEFT JOIN teachers t ON t.user_id = u.id
+        LEFT JOIN students s ON s.user_id = u.id
+        WHERE u.id = ?
+    ''', (user_id,), one=True)
+
+token_cache = TokenCache(max_size=app.config['TOKEN_CACHE_SIZE'])
+identities = IdentityCache(load_identity, ttl=app.config['IDENTITY_CACHE_TTL'])
+
 def role_required(role):
     def decorator(f):
         @wraps(f)
@@ -187,19 +520,461 @@ def role_required(role):
 # DATABASE HELPER FUNCTIONS
 # ============================================
 
-def get_db():
-    conn = sqlite3.connect(app.config['DATABASE'])
-    conn.execute('PRAGMA foreign_keys = ON')
-    conn.row_factory = sqlite3.Row
-    return conn
-
 def query_db(query, args=(), one=False):
-    conn = get_db()
-    cursor = conn.execute(query, args)
+    start = time.perf_counter()
+    cursor = get_db().execute(query, args)
     rv = cursor.fetchall()
-    conn.close()
+    elapsed = time.perf_counter() - start
+    if metrics.enabled:
+        db_query_latency.observe(elapsed, query.split(None, 1)[0].upper())
+    if app.config['DB_SLOW_QUERY_MS'] and elapsed * 1000 >= app.config['DB_SLOW_QUERY_MS']:
+        slow_queries.inc()
+        app.logger.warning('Slow query (%.1f ms): %s', elapsed * 1000, ' '.join(query.split())[:500])
     return (dict(rv[0]) if rv else None) if one else [dict(row) for row in rv]
 
+def load_encodings(class_ids=None):
+    """(class_id, student_id, face_encoding) rows of the given classes, or of all"""
+    query = 'SELECT class_id, id, face_encoding FROM students WHERE face_encoding IS NOT NULL'
+    if class_ids is not None:
+        query += f" AND class_id IN ({','.join('?' * len(class_ids))})"
+    return get_db().execute(query + ' ORDER BY class_id, id', list(class_ids or ())).fetchall()
+
+def fetch_attendance_since(session_id, since=0):
+    """Attendance rows of a session with an id greater than the cursor"""
+    return query_db('''
+        SELECT a.id, u.name, u.email, a.marked_at
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        JOIN users u ON s.user_id = u.id
+        WHERE a.session_id = ? AND a.id > ?
+        ORDER BY a.id
+    ''', (session_id, since))
+
+# ============================================
+# ACTIVE SESSIONS
+# ============================================
+
+SESSION_DETAILS_QUERY = '''
+    SELECT s.id as session_id, s.code, s.class_id, c.name as class_name,
+           sub.name as subject_name, sub.id as subject_id, s.teacher_id, s.start_time, s.expires_at
+    FROM sessions s
+    JOIN classes c ON s.class_id = c.id
+    JOIN subjects sub ON s.subject_id = sub.id
+'''
+
+def load_active_sessions():
+    """Running sessions not yet past their grace period, found through the expiry index"""
+    return query_db(SESSION_DETAILS_QUERY + ' WHERE s.is_active = 1 AND s.expires_at > ?',
+                    (time.time() - app.config['SESSION_SUBMIT_GRACE_SECONDS'],))
+
+def find_active_session(code=None, session_id=None, grace=0):
+    """Look up a running session by code or id, in memory first.
+
+    A miss falls back to an indexed query so sessions started by another
+    worker process are found (and cached) as well.
+    """
+    if code is not None:
+        entry = active_sessions.by_code(code, grace)
+    else:
+        entry = active_sessions.by_id(session_id, grace)
+    if entry:
+        return entry
+    
+    live_after = time.time() - grace
+    if code is not None:
+        entry = query_db(SESSION_DETAILS_QUERY + ' WHERE s.code = ? AND s.is_active = 1 AND s.expires_at > ?',
+                         (code, live_after), one=True)
+    else:
+        # Ending a session brings expires_at forward, so a session ended
+        # within the grace period is still found
+        entry = query_db(SESSION_DETAILS_QUERY + ' WHERE s.id = ? AND s.expires_at > ?',
+                         (session_id, live_after), one=True)
+    if entry:
+        active_sessions.add(entry)
+    return entry
+
+def public_session(entry):
+    return {key: entry[key] for key in
+            ('session_id', 'class_id', 'class_name', 'subject_id', 'subject_name')}
+
+# Running sessions keyed by code and id; entries outlive expiry by the grace
+# period so slightly late attendance submissions are still accepted
+active_sessions = ActiveSessionRegistry(retention=app.config['SESSION_SUBMIT_GRACE_SECONDS'])
+
+# Live attendance events keyed by session id, consumed by the teacher stream
+attendance_events = Broker()
+
+def sessions_closed(session_ids):
+    """In-process end hooks: forget the sessions and end their live streams"""
+    for session_id in session_ids:
+        active_sessions.remove(session_id)
+        attendance_events.publish(session_id, {'type': 'end'})
+
+# Ends sessions whose time (and grace period) is up even if the teacher's
+# page never asks, and drops sessions other processes ended from this registry
+session_scheduler = SessionScheduler(
+    connect_db, db_writer.run, sessions_closed,
+    held=active_sessions.ids,
+    grace=app.config['SESSION_SUBMIT_GRACE_SECONDS'],
+    interval=app.config['SESSION_SCHEDULER_INTERVAL_SECONDS'],
+    batch_size=app.config['SESSION_CLOSE_BATCH']
+)
+
+def encodings_changed(generation):
+    # Another process registered a face or moved/deleted a student, which may
+    # also have changed identities cached here
+    identities.clear()
+
+# Per-class encoding matrices used by the attendance hot path, in files every
+# worker maps; invalidated whenever a face is registered or class membership changes
+encoding_store = SharedEncodingStore(app.config['ENCODING_STORE_PATH'], load_encodings,
+                                     on_change=encodings_changed)
+
+# ============================================
+# STARTUP
+# ============================================
+
+_startup_lock = threading.Lock()
+_started = False
+
+def startup():
+    """Create directories, initialise the database and load running sessions.
+
+    Importing the module has no side effects; this runs once per process
+    tree. gunicorn.conf.py calls it (in the master when preloading), as do
+    `python app.py` and the CLI commands, and the first request runs it for
+    any other server.
+    """
+    global _started
+    with _startup_lock:
+        if _started:
+            return
+        for dir_path in ['database', 'static/faces', 'static/models', app.config['ENROLLMENT_DIR']]:
+            try:
+                os.makedirs(dir_path, exist_ok=True)
+            except FileExistsError:
+                print(f"Warning: '{dir_path}' exists as a file. Please remove it to allow directory creation.")
+        init_db()
+        # The database may have been restored or edited while we were down
+        encoding_store.rebuild()
+        # Rebuild from the database so a restart does not forget running sessions
+        active_sessions.replace_all(load_active_sessions())
+        close_db()
+        _started = True
+
+_background_started = False
+
+def start_background():
+    """Start this process's attendance queue and session scheduler threads (once).
+
+    Kept apart from startup(): that runs once per process tree, often in a
+    parent that never serves requests, while these threads are needed in
+    every serving process.
+    """
+    global _background_started
+    if _background_started:
+        return
+    # Also picks up jobs queued before a restart
+    attendance_queue.start()
+    session_scheduler.start()
+    _background_started = True
+
+@app.before_request
+def ensure_started():
+    if not _started:
+        startup()
+    start_background()
+
+def warm_up(start_pools=True):
+    """Load what the first attendance requests would otherwise wait for.
+
+    Maps the encoding store for classes with running sessions and, when
+    face pool workers are forked straight from this process, imports the
+    face stack here so they share it. With start_pools the face pool
+    workers are started now, loading their models before the first upload,
+    and so are the attendance queue and session scheduler threads.
+    Under `gunicorn --preload` the master calls this with start_pools=False
+    and forked workers share the result copy-on-write; the face stack is
+    loaded in the master only with the 'fork' start method, as a fork
+    server cannot be shared by processes the master forks afterwards.
+    """
+    startup()
+    if app.config['FACE_POOL_START_METHOD'] == 'fork' and app.config['FACE_BACKEND'] != 'stub':
+        load_face_stack()
+    for entry in load_active_sessions():
+        encoding_store.get(entry['class_id'])
+    close_db()
+    if start_pools:
+        face_pool.start()
+        start_background()
+
+# ============================================
+# FACE PROCESSING HELPERS
+# ============================================
+
+def decode_data_url(image_data, max_bytes=None):
+    """Return the raw bytes of a base64 data URL sent by the browser.
+
+    Aborts with 413 before decoding if the image is larger than max_bytes.
+    """
+    encoded = image_data.partition(',')[2]
+    if max_bytes is not None and len(encoded) * 3 // 4 > max_bytes + 2:
+        abort(413)
+    return base64.b64decode(encoded)
+
+def read_face_upload():
+    """Return (image bytes or None, other fields) of a selfie upload.
+
+    Accepts a raw image/jpeg or image/png body with the other fields in the
+    query string, multipart/form-data with an 'image' file, or JSON with a
+    base64 data URL (older clients). Binary bodies are read once from the
+    request stream with no base64 or string copies; all paths are limited to
+    FACE_UPLOAD_MAX_BYTES of image data.
+    """
+    max_bytes = app.config['FACE_UPLOAD_MAX_BYTES']
+    if request.mimetype in ('image/jpeg', 'image/png'):
+        request.max_content_length = max_bytes
+        return request.get_data(cache=False) or None, request.args
+    if request.mimetype == 'multipart/form-data':
+        request.max_content_length = max_bytes + 64 * 1024
+        upload = request.files.get('image')
+        return (upload.read() or None) if upload else None, request.form
+
+    # base64 adds a third, plus the data URL prefix and other fields
+    request.max_content_length = max_bytes * 4 // 3 + 64 * 1024
+    data = request.get_json(silent=True) or {}
+    image = data.get('image')
+    if image and not isinstance(image, str):
+        abort(400)
+    return (decode_data_url(image, max_bytes) if image else None), data
+
+def face_options(group=False):
+    """Detector settings passed to the face engine jobs"""
+    return {
+        'max_dimension': app.config['GROUP_PHOTO_MAX_DIMENSION' if group else 'FACE_DETECTION_MAX_DIMENSION'],
+        'model': app.config['FACE_DETECTION_MODEL'],
+        'upsample': app.config['FACE_DETECTION_UPSAMPLE'],
+        'jitters': app.config['FACE_ENCODING_JITTERS'],
+        'backend': app.config['FACE_BACKEND']
+    }
+
+def record_face_timings(endpoint, timings):
+    """Record the face job's per-stage timings (ms) and optionally log them"""
+    for stage, ms in timings.items():
+        face_stage_latency.observe(ms / 1000, endpoint, stage)
+    if app.config['FACE_TIMING_LOG']:
+        app.logger.info('%s face timings: %s', endpoint,
+                        ', '.join(f'{stage}={ms}ms' for stage, ms in timings.items()))
+
+# ============================================
+# BULK FACE ENROLLMENT
+# ============================================
+
+# Archives uploaded through the API are saved in ENROLLMENT_DIR under this prefix
+ENROLLMENT_UPLOAD_PREFIX = 'upload-'
+
+def invalidate_enrolled_classes(conn, student_ids):
+    placeholders = ','.join('?' * len(student_ids))
+    class_ids = [row['class_id'] for row in conn.execute(
+        f'SELECT DISTINCT class_id FROM students WHERE id IN ({placeholders})', student_ids)]
+    encoding_store.invalidate(*class_ids)
+
+def enrollment_runner():
+    return EnrollmentRunner(
+        connect_db, enrollment_pool,
+        options=face_options(),
+        dtype=app.config['FACE_ENCODING_DTYPE'],
+        batch_size=app.config['ENROLLMENT_BATCH_SIZE'],
+        checkpoint_seconds=app.config['ENROLLMENT_CHECKPOINT_SECONDS'],
+        max_image_bytes=app.config['ENROLLMENT_MAX_IMAGE_BYTES'],
+        on_enrolled=invalidate_enrolled_classes
+    )
+
+def start_enrollment(job_id):
+    """Run a claimed job in a background thread of this process"""
+    runner = enrollment_runner()
+    
+    def run():
+        try:
+            runner.run(job_id)
+        except Exception:
+            # Failed jobs can be resumed, so their upload is kept
+            app.logger.exception('Enrollment job %s failed', job_id)
+        else:
+            remove_enrollment_upload(job_id)
+    
+    threading.Thread(target=run, name=f'enrollment-{job_id}', daemon=True).start()
+
+def remove_enrollment_upload(job_id):
+    """Delete the uploaded archive of a completed job; student photos are not kept"""
+    conn = connect_db()
+    try:
+        source = conn.execute('SELECT source FROM enrollment_jobs WHERE id = ?', (job_id,)).fetchone()['source']
+    finally:
+        conn.close()
+    # Directories the admin placed in ENROLLMENT_DIR are theirs to manage
+    root = os.path.realpath(app.config['ENROLLMENT_DIR'])
+    if os.path.dirname(source) == root and os.path.basename(source).startswith(ENROLLMENT_UPLOAD_PREFIX):
+        try:
+            os.remove(source)
+        except FileNotFoundError:
+            pass
+
+# ============================================
+# ATTENDANCE AND SESSION WRITES
+# ============================================
+
+# Operations for db_writer: each runs inside the writer's transaction and
+# must not commit
+
+def insert_attendance(conn, session_id, subject_id, student_ids):
+    """Mark students present; returns {student_id: attendance id} for rows really added"""
+    added = {}
+    # One by one so only rows that were really added bump the counters; the
+    # unique index makes a duplicate a no-op
+    for student_id in student_ids:
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO attendance (session_id, student_id, status)
+            VALUES (?, ?, 'present')
+        ''', (session_id, student_id))
+        if cursor.rowcount:
+            added[student_id] = cursor.lastrowid
+    attendance_marked(conn, session_id, subject_id, list(added))
+    return added
+
+def create_session(conn, teacher_id, class_id, subject_id):
+    """Start a session under a code no other active session uses; returns (id, code, duration)"""
+    durations = conn.execute('''
+        SELECT sub.session_duration AS subject_duration, c.session_duration AS class_duration
+        FROM subjects sub JOIN classes c ON c.id = ?
+        WHERE sub.id = ?
+    ''', (class_id, subject_id)).fetchone()
+    duration = ((durations and (durations['subject_duration'] or durations['class_duration']))
+                or app.config['SESSION_DURATION_SECONDS'])
+    code = generate_session_code(conn)
+    cursor = conn.execute('''
+        INSERT INTO sessions (teacher_id, class_id, subject_id, code, expires_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (teacher_id, class_id, subject_id, code, time.time() + duration))
+    session_started(conn, cursor.lastrowid, class_id, subject_id)
+    return cursor.lastrowid, code, duration
+
+# ============================================
+# ATTENDANCE VERIFICATION
+# ============================================
+
+def submission_error(student, session):
+    """Why an attendance selfie cannot be accepted, as (message, status), or None"""
+    if not session:
+        return 'Invalid code or session expired', 400
+    if session['class_id'] != student['class_id']:
+        return 'You are not eligible for this subject', 403
+    if encoding_store.get(student['class_id']).row(student['id']) is None:
+        return 'Face not registered', 400
+    existing = query_db('''
+        SELECT id FROM attendance 
+        WHERE session_id = ? AND student_id = ?
+    ''', (session['session_id'], student['id']), one=True)
+    if existing:
+        return 'Attendance already marked', 400
+    return None
+
+def verify_and_mark(student, session, image, endpoint):
+    """Check a selfie against the student's stored face and record them present.
+
+    Returns (message, status). Face problems raise FaceValidationError, a
+    busy or slow face pool PoolBusyError or JobTimeoutError.
+    """
+    # Decode and verify face in the face-processing pool
+    with face_stage_latency.time(endpoint, 'face_job'):
+        result = face_pool.run(encode_single_face, image, face_options())
+    record_face_timings(endpoint, result['timings'])
+    
+    # Compare with the stored encoding held in the class matrix
+    with face_stage_latency.time(endpoint, 'compare'):
+        distance = encoding_store.get(student['class_id']).distance_to(student['id'], result['encoding'])
+    
+    if distance is None:
+        return 'Face not registered', 400
+    if distance > app.config['FACE_MATCH_TOLERANCE']:
+        return 'Face verification failed', 400
+    
+    # Mark attendance, committed together with other requests' writes
+    with face_stage_latency.time(endpoint, 'db'):
+        added = db_writer.run(insert_attendance, session['session_id'], session['subject_id'], [student['id']])
+    
+    if not added:
+        return 'Attendance already marked', 400
+    
+    attendance_events.publish(session['session_id'], {'type': 'attendance', 'row': {
+        'id': added[student['id']],
+        'name': student['name'],
+        'email': student['email'],
+        'marked_at': datetime.datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
+    }})
+    return 'Attendance marked successfully', 200
+
+def process_attendance_job(job):
+    """Verify a queued selfie; the session may have ended since it was accepted"""
+    face_stage_latency.observe(time.time() - job['submitted_at'], 'attendance_job', 'queue_wait')
+    student = query_db('''
+        SELECT s.id, s.class_id, u.name, u.email FROM students s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.id = ?
+    ''', (job['student_id'],), one=True)
+    session = query_db(SESSION_DETAILS_QUERY + ' WHERE s.id = ?', (job['session_id'],), one=True)
+    if not student or not session:
+        return 404, 'Session or student no longer exists'
+    try:
+        message, status = verify_and_mark(student, session, job['image'], 'attendance_job')
+    except FaceValidationError as e:
+        message, status = str(e), 400
+    except JobTimeoutError:
+        message, status = 'Face processing timed out, please try again', 503
+    return status, message
+
+# Selfies submitted with `Prefer: respond-async` are verified by these threads
+attendance_queue = AttendanceQueue(
+    connect_db, db_writer.run, process_attendance_job,
+    workers=app.config['ATTENDANCE_QUEUE_WORKERS'],
+    stale_after=2 * app.config['FACE_JOB_TIMEOUT'],
+    retention=app.config['ATTENDANCE_JOB_RETENTION_SECONDS']
+)
+
+# ============================================
+# ERROR HANDLERS
+# ============================================
+
+@app.errorhandler(FaceValidationError)
+def handle_face_validation_error(e):
+    return jsonify({'message': str(e)}), 400
+
+@app.errorhandler(BulkImportError)
+def handle_bulk_import_error(e):
+    return jsonify({'message': str(e)}), 400
+
+@app.errorhandler(413)
+def handle_request_too_large(e):
+    return jsonify({'message': 'Upload is too large'}), 413
+
+@app.errorhandler(PoolBusyError)
+def handle_pool_busy(e):
+    response = jsonify({'message': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@app.errorhandler(JobTimeoutError)
+def handle_job_timeout(e):
+    response = jsonify({'message': str(e)})
+    response.headers['Retry-After'] = str(app.config['FACE_POOL_RETRY_AFTER'])
+    return response, 503
+
+@app.errorhandler(WriteTimeoutError)
+def handle_write_timeout(e):
+    response = jsonify({'message': str(e)})
+    response.headers['Retry-After'] = '2'
+    return response, 503
+
 # ============================================
 # ROUTES - HTML Pages
 # ============================================
@@ -233,18 +1008,41 @@ def login():
     if not email or not password:
         return jsonify({'message': 'Missing credentials'}), 400
     
-    user = query_db('SELECT * FROM users WHERE email = ?', 
-                    (email,), one=True)
+    user = query_db('''
+        SELECT u.*, t.id as teacher_id, s.id as student_id
+        FROM users u
+        LEFT JOIN teachers t ON t.user_id = u.id
+        LEFT JOIN students s ON s.user_id = u.id
+        WHERE u.email = ?
+    ''', (email,), one=True)
+    
+    if not user:
+        return jsonify({'message': 'Invalid credentials'}), 401
     
-    if not user or not check_password_hash(user['password'], password):
+    valid, new_hash = password_pool.run(verify_password, user['password'], password,
+                                        app.config['PASSWORD_HASH_METHOD'])
+    if not valid:
         return jsonify({'message': 'Invalid credentials'}), 401
     
-    token = jwt.encode({
+    if new_hash:
+        # The hashing policy changed; store the password under the new one
+        # unless the password itself changed meanwhile
+        conn = get_db()
+        conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                     (new_hash, user['id'], user['password']))
+        conn.commit()
+    
+    claims = {
         'user_id': user['id'],
         'email': user['email'],
         'role': user['role'],
         'exp': datetime.datetime.utcnow() + datetime.timedelta(days=7)
-    }, app.config['SECRET_KEY'])
+    }
+    if user['teacher_id']:
+        claims['teacher_id'] = user['teacher_id']
+    if user['student_id']:
+        claims['student_id'] = user['student_id']
+    token = jwt.encode(claims, app.config['SECRET_KEY'])
     
     return jsonify({
         'token': token,
@@ -264,34 +1062,34 @@ def login():
 @token_required
 @role_required('admin')
 def get_admin_stats(current_user):
-    conn = get_db()
-    
-    classes = conn.execute('SELECT COUNT(*) as count FROM classes').fetchone()['count']
-    students = conn.execute('SELECT COUNT(*) as count FROM students').fetchone()['count']
-    teachers = conn.execute('SELECT COUNT(*) as count FROM teachers').fetchone()['count']
-    subjects = conn.execute('SELECT COUNT(*) as count FROM subjects').fetchone()['count']
-    
-    conn.close()
+    # Row counts are kept up to date by triggers (see migrations.py)
+    counts = {row['entity']: row['count'] for row in query_db('SELECT entity, count FROM entity_counts')}
     
     return jsonify({
-        'classes': classes,
-        'students': students,
-        'teachers': teachers,
-        'subjects': subjects
+        'classes': counts.get('classes', 0),
+        'students': counts.get('students', 0),
+        'teachers': counts.get('teachers', 0),
+        'subjects': counts.get('subjects', 0)
     })
 
+SESSION_DURATION_ERROR = 'Session duration must be a whole number of seconds between 10 and 86400'
+
+def session_duration_arg(data):
+    """Optional per-class/subject session length in seconds; None means the default"""
+    value = data.get('session_duration')
+    if value is None or value == '':
+        return None
+    value = int(value)
+    if not 10 <= value <= 86400:
+        raise ValueError(SESSION_DURATION_ERROR)
+    return value
+
 @app.route('/api/admin/classes', methods=['GET', 'POST'])
 @token_required
 @role_required('admin')
 def manage_classes(current_user):
     if request.method == 'GET':
-        classes = query_db('''
-            SELECT c.*, COUNT(DISTINCT s.id) as student_count
-            FROM classes c
-            LEFT JOIN students s ON c.id = s.class_id
-            GROUP BY c.id
-            ORDER BY c.name
-        ''')
+        classes = query_db('SELECT * FROM classes ORDER BY name')
         return jsonify(classes)
     
     elif request.method == 'POST':
@@ -300,16 +1098,113 @@ def manage_classes(current_user):
         
         if not name:
             return jsonify({'message': 'Class name required'}), 400
+        try:
+            session_duration = session_duration_arg(data)
+        except (TypeError, ValueError):
+            return jsonify({'message': SESSION_DURATION_ERROR}), 400
         
         try:
             conn = get_db()
-            conn.execute('INSERT INTO classes (name) VALUES (?)', (name,))
+            conn.execute('INSERT INTO classes (name, session_duration) VALUES (?, ?)',
+                         (name, session_duration))
             conn.commit()
-            conn.close()
             return jsonify({'message': 'Class created successfully'}), 201
         except sqlite3.IntegrityError:
             return jsonify({'message': 'Class already exists'}), 400
 
+@app.route('/api/admin/import', methods=['POST'])
+@token_required
+@role_required('admin')
+def bulk_import(current_user):
+    """Create many students and teacher assignments from CSV or JSON.
+
+    JSON bodies hold 'students' and/or 'teachers' lists. CSV comes as an
+    uploaded 'file' or a text/csv body, with ?kind=students|teachers.
+    ?class_id= sets the class for rows that do not name one.
+    """
+    default_class_id = request.values.get('class_id')
+    
+    if request.is_json:
+        data = request.json or {}
+        batches = {kind: normalize_rows(data[kind]) for kind in IMPORT_KINDS if kind in data}
+    else:
+        kind = request.values.get('kind')
+        if kind not in IMPORT_KINDS:
+            return jsonify({'message': 'kind must be students or teachers'}), 400
+        upload = request.files.get('file')
+        raw = upload.read() if upload else request.get_data()
+        try:
+            batches = {kind: parse_csv(raw.decode('utf-8-sig'))}
+        except UnicodeDecodeError:
+            return jsonify({'message': 'CSV must be UTF-8 encoded'}), 400
+    
+    if not batches:
+        return jsonify({'message': 'Nothing to import'}), 400
+    if sum(map(len, batches.values())) > app.config['IMPORT_MAX_ROWS']:
+        return jsonify({'message': f"At most {app.config['IMPORT_MAX_ROWS']} rows per import"}), 400
+    
+    def hash_fn(passwords):
+        return hash_in_pool(password_pool, passwords, app.config['PASSWORD_HASH_METHOD'],
+                            batch_size=app.config['IMPORT_HASH_BATCH'])
+    
+    conn = get_db()
+    importers = {'students': import_students, 'teachers': import_teachers}
+    results = {}
+    for kind, rows in batches.items():
+        results[kind] = importers[kind](conn, rows, hash_fn,
+                                        chunk_size=app.config['IMPORT_CHUNK_SIZE'],
+                                        default_class_id=default_class_id)
+    return jsonify(results)
+
+@app.route('/api/admin/enrollment', methods=['POST'])
+@token_required
+@role_required('admin')
+def create_enrollment_job(current_user):
+    """Start enrolling faces from an uploaded zip or a directory inside ENROLLMENT_DIR"""
+    root = os.path.realpath(app.config['ENROLLMENT_DIR'])
+    upload = request.files.get('file')
+    
+    if upload:
+        source = os.path.join(root, f'{ENROLLMENT_UPLOAD_PREFIX}{secrets.token_hex(8)}.zip')
+        upload.save(source)
+        if not zipfile.is_zipfile(source):
+            os.remove(source)
+            return jsonify({'message': 'Upload must be a zip archive'}), 400
+    else:
+        path = (request.get_json(silent=True) or {}).get('path')
+        if not path:
+            return jsonify({'message': 'Upload a zip file or give a directory path'}), 400
+        source = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, source]) != root or not os.path.isdir(source):
+            return jsonify({'message': 'Directory not found in the enrollment folder'}), 400
+    
+    conn = get_db()
+    job_id = create_job(conn, source)
+    claim_job(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS'])
+    start_enrollment(job_id)
+    return jsonify(job_status(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS'])), 202
+
+@app.route('/api/admin/enrollment/<int:job_id>', methods=['GET'])
+@token_required
+@role_required('admin')
+def get_enrollment_job(current_user, job_id):
+    status = job_status(get_db(), job_id, app.config['ENROLLMENT_STALE_SECONDS'])
+    if status is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(status)
+
+@app.route('/api/admin/enrollment/<int:job_id>/resume', methods=['POST'])
+@token_required
+@role_required('admin')
+def resume_enrollment_job(current_user, job_id):
+    conn = get_db()
+    if not claim_job(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS']):
+        if job_status(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS']) is None:
+            return jsonify({'message': 'Job not found'}), 404
+        return jsonify({'message': 'Job is running or already completed'}), 409
+    start_enrollment(job_id)
+    return jsonify(job_status(conn, job_id, app.config['ENROLLMENT_STALE_SECONDS'])), 202
+
 @app.route('/api/admin/classes/<int:class_id>', methods=['PUT', 'DELETE'])
 @token_required
 @role_required('admin')
@@ -318,7 +1213,9 @@ def manage_single_class(current_user, class_id):
     if request.method == 'DELETE':
         conn.execute('DELETE FROM classes WHERE id = ?', (class_id,))
         conn.commit()
-        conn.close()
+        # The class's students were deleted with it
+        identities.clear()
+        encoding_store.invalidate(class_id)
         return jsonify({'message': 'Class deleted successfully'})
 
     elif request.method == 'PUT':
@@ -326,13 +1223,19 @@ def manage_single_class(current_user, class_id):
         name = data.get('name')
         if not name:
             return jsonify({'message': 'Class name required'}), 400
+        try:
+            session_duration = session_duration_arg(data)
+        except (TypeError, ValueError):
+            return jsonify({'message': SESSION_DURATION_ERROR}), 400
         try:
             conn.execute('UPDATE classes SET name = ? WHERE id = ?', (name, class_id))
+            # Running sessions keep the expiry they started with
+            if 'session_duration' in data:
+                conn.execute('UPDATE classes SET session_duration = ? WHERE id = ?',
+                             (session_duration, class_id))
             conn.commit()
-            conn.close()
             return jsonify({'message': 'Class updated successfully'})
         except sqlite3.IntegrityError:
-            conn.close()
             return jsonify({'message': 'Class name already exists'}), 400
 
 @app.route('/api/admin/classes/<int:class_id>/subjects', methods=['GET', 'POST'])
@@ -352,14 +1255,17 @@ def manage_subjects(current_user, class_id):
         
         if not name or not code:
             return jsonify({'message': 'Subject name and code required'}), 400
+        try:
+            session_duration = session_duration_arg(data)
+        except (TypeError, ValueError):
+            return jsonify({'message': SESSION_DURATION_ERROR}), 400
         
         conn = get_db()
         conn.execute(
-            'INSERT INTO subjects (class_id, name, code) VALUES (?, ?, ?)',
-            (class_id, name, code)
+            'INSERT INTO subjects (class_id, name, code, session_duration) VALUES (?, ?, ?, ?)',
+            (class_id, name, code, session_duration)
         )
         conn.commit()
-        conn.close()
         return jsonify({'message': 'Subject created successfully'}), 201
 
 @app.route('/api/admin/classes/<int:class_id>/teachers', methods=['GET', 'POST'])
@@ -402,7 +1308,7 @@ def manage_teachers(current_user, class_id):
                 if not password:
                     return jsonify({'message': 'Password required for new teacher'}), 400
                     
-                hashed_password = generate_password_hash(password)
+                hashed_password = hash_password(password, app.config['PASSWORD_HASH_METHOD'])
                 cursor = conn.execute(
                     'INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, ?)',
                     (email, hashed_password, name, 'teacher')
@@ -426,7 +1332,6 @@ def manage_teachers(current_user, class_id):
                     )
             
             conn.commit()
-            conn.close()
             return jsonify({'message': 'Teacher created successfully'}), 201
         except sqlite3.IntegrityError:
             return jsonify({'message': 'Email already exists'}), 400
@@ -453,7 +1358,7 @@ def update_teacher(current_user, teacher_id):
         user_id = teacher['user_id']
 
         if password:
-            hashed = generate_password_hash(password)
+            hashed = hash_password(password, app.config['PASSWORD_HASH_METHOD'])
             conn.execute('UPDATE users SET name = ?, email = ?, password = ? WHERE id = ?',
                          (name, email, hashed, user_id))
         else:
@@ -468,11 +1373,10 @@ def update_teacher(current_user, teacher_id):
                              (teacher_id, sub_id, class_id))
 
         conn.commit()
+        identities.invalidate(user_id)
         return jsonify({'message': 'Teacher updated successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'message': 'Email already exists'}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/admin/teachers/<int:teacher_id>/class/<int:class_id>/subjects', methods=['GET'])
 @token_required
@@ -506,7 +1410,7 @@ def manage_students(current_user, class_id):
         
         try:
             conn = get_db()
-            hashed_password = generate_password_hash(password)
+            hashed_password = hash_password(password, app.config['PASSWORD_HASH_METHOD'])
             
             cursor = conn.execute(
                 'INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, ?)',
@@ -520,7 +1424,6 @@ def manage_students(current_user, class_id):
             )
             
             conn.commit()
-            conn.close()
             return jsonify({'message': 'Student created successfully'}), 201
         except sqlite3.IntegrityError:
             return jsonify({'message': 'Email already exists'}), 400
@@ -540,13 +1443,13 @@ def update_student(current_user, student_id):
 
     conn = get_db()
     try:
-        student = conn.execute('SELECT user_id FROM students WHERE id = ?', (student_id,)).fetchone()
+        student = conn.execute('SELECT user_id, class_id FROM students WHERE id = ?', (student_id,)).fetchone()
         if not student:
             return jsonify({'message': 'Student not found'}), 404
         user_id = student['user_id']
 
         if password:
-            hashed = generate_password_hash(password)
+            hashed = hash_password(password, app.config['PASSWORD_HASH_METHOD'])
             conn.execute('UPDATE users SET name = ?, email = ?, password = ? WHERE id = ?',
                          (name, email, hashed, user_id))
         else:
@@ -557,11 +1460,12 @@ def update_student(current_user, student_id):
             conn.execute('UPDATE students SET class_id = ? WHERE id = ?', (class_id, student_id))
 
         conn.commit()
+        identities.invalidate(user_id)
+        if class_id and int(class_id) != student['class_id']:
+            encoding_store.invalidate(student['class_id'], class_id)
         return jsonify({'message': 'Student updated successfully'})
     except sqlite3.IntegrityError:
         return jsonify({'message': 'Email already exists'}), 400
-    finally:
-        conn.close()
 
 @app.route('/api/admin/subjects/<int:subject_id>', methods=['DELETE'])
 @token_required
@@ -570,9 +1474,27 @@ def delete_subject(current_user, subject_id):
     conn = get_db()
     conn.execute('DELETE FROM subjects WHERE id = ?', (subject_id,))
     conn.commit()
-    conn.close()
     return jsonify({'message': 'Subject deleted successfully'})
 
+@app.route('/api/admin/subjects/<int:subject_id>', methods=['PUT'])
+@token_required
+@role_required('admin')
+def update_subject(current_user, subject_id):
+    data = request.json
+    try:
+        session_duration = session_duration_arg(data)
+    except (TypeError, ValueError):
+        return jsonify({'message': SESSION_DURATION_ERROR}), 400
+    
+    conn = get_db()
+    for column in ('name', 'code'):
+        if data.get(column):
+            conn.execute(f'UPDATE subjects SET {column} = ? WHERE id = ?', (data[column], subject_id))
+    if 'session_duration' in data:
+        conn.execute('UPDATE subjects SET session_duration = ? WHERE id = ?', (session_duration, subject_id))
+    conn.commit()
+    return jsonify({'message': 'Subject updated successfully'})
+
 @app.route('/api/admin/teachers/<int:teacher_id>', methods=['DELETE'])
 @token_required
 @role_required('admin')
@@ -588,7 +1510,8 @@ def delete_teacher(current_user, teacher_id):
         if user_id:
             conn.execute('DELETE FROM users WHERE id = ?', (user_id['user_id'],))
     conn.commit()
-    conn.close()
+    if not class_id and user_id:
+        identities.invalidate(user_id['user_id'])
     return jsonify({'message': 'Teacher deleted successfully'})
 
 @app.route('/api/admin/students/<int:student_id>', methods=['DELETE'])
@@ -596,11 +1519,14 @@ def delete_teacher(current_user, teacher_id):
 @role_required('admin')
 def delete_student(current_user, student_id):
     conn = get_db()
-    user_id = conn.execute('SELECT user_id FROM students WHERE id = ?', (student_id,)).fetchone()
-    if user_id:
-        conn.execute('DELETE FROM users WHERE id = ?', (user_id['user_id'],))
+    student = conn.execute('SELECT user_id, class_id FROM students WHERE id = ?', (student_id,)).fetchone()
+    if student:
+        student_removed(conn, student_id)
+        conn.execute('DELETE FROM users WHERE id = ?', (student['user_id'],))
     conn.commit()
-    conn.close()
+    if student:
+        identities.invalidate(student['user_id'])
+        encoding_store.invalidate(student['class_id'])
     return jsonify({'message': 'Student deleted successfully'})
 
 # ============================================
@@ -611,12 +1537,8 @@ def delete_student(current_user, student_id):
 @token_required
 @role_required('teacher')
 def get_teacher_profile(current_user):
-    teacher = query_db('''
-        SELECT t.id, u.name, u.email
-        FROM teachers t
-        JOIN users u ON t.user_id = u.id
-        WHERE u.id = ?
-    ''', (current_user['user_id'],), one=True)
+    teacher = {'id': current_user['teacher_id'], 'name': current_user['name'],
+               'email': current_user['email']}
     
     subjects = query_db('''
         SELECT s.name as subject_name, s.code as course_code, c.name as class_name
@@ -633,9 +1555,6 @@ def get_teacher_profile(current_user):
 @token_required
 @role_required('teacher')
 def get_teacher_classes_subjects(current_user):
-    teacher = query_db('SELECT id FROM teachers WHERE user_id = ?', 
-                      (current_user['user_id'],), one=True)
-    
     data = query_db('''
         SELECT DISTINCT c.id as class_id, c.name as class_name,
                s.id as subject_id, s.name as subject_name, s.code as course_code
@@ -643,12 +1562,21 @@ def get_teacher_classes_subjects(current_user):
         JOIN classes c ON ts.class_id = c.id
         JOIN subjects s ON ts.subject_id = s.id
         WHERE ts.teacher_id = ?
-    ''', (teacher['id'],))
+    ''', (current_user['teacher_id'],))
     
     return jsonify(data)
 
-def generate_session_code():
-    return ''.join(random.choices(string.digits, k=6))
+def generate_session_code(conn):
+    """Generate a 6-digit code that no running session is using.
+
+    Checked on the caller's connection: inside the writer's transaction no
+    other process can take the code before the session is inserted.
+    """
+    while True:
+        code = ''.join(random.choices(string.digits, k=6))
+        # Active sessions past their expiry keep their code until closed
+        if conn.execute('SELECT 1 FROM sessions WHERE code = ? AND is_active = 1', (code,)).fetchone() is None:
+            return code
 
 @app.route('/api/teacher/start-session', methods=['POST'])
 @token_required
@@ -658,37 +1586,33 @@ def start_session(current_user):
     class_id = data.get('class_id')
     subject_id = data.get('subject_id')
     
-    teacher = query_db('SELECT id FROM teachers WHERE user_id = ?', 
-                      (current_user['user_id'],), one=True)
-    
-    code = generate_session_code()
-    
-    conn = get_db()
-    cursor = conn.execute('''
-        INSERT INTO sessions (teacher_id, class_id, subject_id, code)
-        VALUES (?, ?, ?, ?)
-    ''', (teacher['id'], class_id, subject_id, code))
-    
-    session_id = cursor.lastrowid
-    conn.commit()
+    session_id, code, duration = db_writer.run(create_session, current_user['teacher_id'], class_id, subject_id)
     
-    session_info = query_db('''
-        SELECT s.id, s.code, c.name as class_name, sub.name as subject_name
-        FROM sessions s
-        JOIN classes c ON s.class_id = c.id
-        JOIN subjects sub ON s.subject_id = sub.id
-        WHERE s.id = ?
-    ''', (session_id,), one=True)
+    entry = query_db(SESSION_DETAILS_QUERY + ' WHERE s.id = ?', (session_id,), one=True)
+    active_sessions.add(entry)
     
-    conn.close()
-    return jsonify(session_info), 201
+    # Index the class's encodings now so the first attendance marks find them ready
+    encoding_store.get(class_id)
+    return jsonify({
+        'id': session_id,
+        'code': code,
+        'class_name': entry['class_name'],
+        'subject_name': entry['subject_name'],
+        'duration': duration
+    }), 201
 
 @app.route('/api/teacher/session/<int:session_id>/attendance', methods=['GET'])
 @token_required
 @role_required('teacher')
 def get_session_attendance(current_user, session_id):
+    since = request.args.get('since', type=int)
+    
+    # Incremental mode: only rows newer than the client's cursor
+    if since is not None:
+        return jsonify(fetch_attendance_since(session_id, since))
+    
     attendance = query_db('''
-        SELECT u.name, u.email, a.marked_at
+        SELECT a.id, u.name, u.email, a.marked_at
         FROM attendance a
         JOIN students s ON a.student_id = s.id
         JOIN users u ON s.user_id = u.id
@@ -698,21 +1622,209 @@ def get_session_attendance(current_user, session_id):
     
     return jsonify(attendance)
 
+def sse_event(event, data, event_id=None):
+    message = f'event: {event}\ndata: {json.dumps(data)}\n'
+    if event_id is not None:
+        message = f'id: {event_id}\n' + message
+    return message + '\n'
+
+@app.route('/api/teacher/session/<int:session_id>/attendance/stream-ticket', methods=['POST'])
+@token_required
+@role_required('teacher')
+def attendance_stream_ticket(current_user, session_id):
+    session = query_db('SELECT id FROM sessions WHERE id = ? AND teacher_id = ?',
+                       (session_id, current_user['teacher_id']), one=True)
+    if not session:
+        return jsonify({'message': 'Session not found'}), 404
+    
+    ticket = jwt.encode({
+        'user_id': current_user['user_id'],
+        'purpose': 'attendance-stream',
+        'session_id': session_id,
+        'exp': datetime.datetime.utcnow() + datetime.timedelta(seconds=app.config['ATTENDANCE_STREAM_TICKET_SECONDS'])
+    }, app.config['SECRET_KEY'])
+    return jsonify({'ticket': ticket})
+
+# Each open stream holds a server thread; beyond this many per process the
+# stream answers 503 and the page polls instead
+stream_slots = threading.BoundedSemaphore(app.config['ATTENDANCE_STREAM_MAX_PER_WORKER'])
+
+@app.route('/api/teacher/session/<int:session_id>/attendance/stream', methods=['GET'])
+@stream_ticket_required
+@role_required('teacher')
+def stream_session_attendance(current_user, session_id):
+    session = query_db('''
+        SELECT id, is_active FROM sessions
+        WHERE id = ? AND teacher_id = ?
+    ''', (session_id, current_user['teacher_id']), one=True)
+    
+    if not session:
+        return jsonify({'message': 'Session not found'}), 404
+    
+    if not stream_slots.acquire(blocking=False):
+        response = jsonify({'message': 'Too many live streams, poll the attendance list instead'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    # EventSource resends the last id it saw when it reconnects
+    since = request.headers.get('Last-Event-ID', type=int) or request.args.get('since', 0, type=int)
+    resync = app.config['ATTENDANCE_STREAM_RESYNC_SECONDS']
+    deadline = time.monotonic() + app.config['ATTENDANCE_STREAM_MAX_SECONDS']
+    
+    def stream():
+        subscription = attendance_events.subscribe(session_id)
+        # Rows are always read from the database, never taken from the events:
+        # ids are assigned in commit order, so `id > cursor` misses nothing,
+        # while events may arrive out of order and only cover this worker
+        cursor = since
+        next_resync = time.monotonic() + resync
+        ended = False
+        try:
+            while True:
+                for row in fetch_attendance_since(session_id, cursor):
+                    cursor = row['id']
+                    yield sse_event('attendance', row, row['id'])
+                if ended:
+                    yield sse_event('end', {'session_id': session_id})
+                    return
+                
+                now = time.monotonic()
+                if now >= deadline:
+                    # The page opens a new stream with a fresh ticket
+                    yield sse_event('reconnect', {'since': cursor})
+                    return
+                if now >= next_resync:
+                    # On a timer, busy or not: marks and ends from other
+                    # worker processes are only seen here
+                    next_resync = now + resync
+                    active = query_db('SELECT is_active FROM sessions WHERE id = ?',
+                                      (session_id,), one=True)
+                    if not active or not active['is_active']:
+                        yield sse_event('end', {'session_id': session_id})
+                        return
+                    yield ': keepalive\n\n'
+                
+                # Events only wake the stream; a burst of them costs one query
+                event = subscription.get(timeout=max(min(next_resync, deadline) - time.monotonic(), 0))
+                while event is not None:
+                    ended = ended or event['type'] == 'end'
+                    event = subscription.get(timeout=0)
+                subscription.overflowed = False
+        finally:
+            attendance_events.unsubscribe(subscription)
+    
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(stream_slots.release)
+    return response
+
 @app.route('/api/teacher/session/<int:session_id>/end', methods=['POST'])
 @token_required
 @role_required('teacher')
 def end_session(current_user, session_id):
-    conn = get_db()
-    conn.execute('''
-        UPDATE sessions 
-        SET is_active = 0, end_time = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (session_id,))
-    conn.commit()
-    conn.close()
-    
+    # A no-op if the scheduler or another worker already ended it. The
+    # session expires now but stays for the submission grace period, since
+    # the page ends it the moment its countdown reaches zero
+    db_writer.run(close_sessions, [session_id])
+    active_sessions.expire(session_id, time.time())
+    attendance_events.publish(session_id, {'type': 'end'})
     return jsonify({'message': 'Session ended successfully'})
 
+@app.route('/api/teacher/session/<int:session_id>/group-photo', methods=['POST'])
+@token_required
+@role_required('teacher')
+def mark_group_attendance(current_user, session_id):
+    max_bytes = app.config['FACE_UPLOAD_MAX_BYTES']
+    max_images = app.config['GROUP_PHOTO_MAX_IMAGES']
+    # Same per-photo limit as read_face_upload(), base64 encoded
+    request.max_content_length = max_images * (max_bytes * 4 // 3 + 64 * 1024)
+    data = request.json
+    images = data.get('images') or ([data['image']] if data.get('image') else [])
+    
+    if not images:
+        return jsonify({'message': 'No image provided'}), 400
+    
+    if not isinstance(images, list) or not all(isinstance(image, str) for image in images):
+        return jsonify({'message': 'Photos must be data URLs'}), 400
+    
+    if len(images) > max_images:
+        return jsonify({'message': f"At most {max_images} photos per upload"}), 400
+    
+    session = query_db('''
+        SELECT id, class_id, subject_id FROM sessions
+        WHERE id = ? AND teacher_id = ? AND is_active = 1
+    ''', (session_id, current_user['teacher_id']), one=True)
+    
+    if not session:
+        return jsonify({'message': 'Session not found or no longer active'}), 404
+    
+    # Detect and encode all photos in parallel, then match every face at once
+    images = [decode_data_url(image, max_bytes) for image in images]
+    futures = [face_pool.submit(encode_all_faces, image, face_options(group=True))
+               for image in images]
+    faces = []
+    for image_index, future in enumerate(futures):
+        result = face_pool.result(future)
+        record_face_timings('group_photo', result['timings'])
+        for face in result['faces']:
+            faces.append(dict(face, image=image_index))
+    
+    class_encodings = encoding_store.get(session['class_id'])
+    results = match_group(
+        class_encodings,
+        [face['encoding'] for face in faces],
+        app.config['FACE_MATCH_TOLERANCE'],
+        app.config['FACE_AMBIGUITY_MARGIN']
+    )
+    
+    roster = {row['id']: row for row in query_db('''
+        SELECT s.id, u.name, u.email FROM students s
+        JOIN users u ON s.user_id = u.id
+        WHERE s.class_id = ?
+    ''', (session['class_id'],))}
+    
+    def describe(student_id, distance):
+        student = roster.get(student_id, {})
+        return {'student_id': student_id, 'name': student.get('name'),
+                'email': student.get('email'), 'distance': round(distance, 4)}
+    
+    matched, unmatched, ambiguous = [], [], []
+    for face, result in zip(faces, results):
+        position = {'image': face['image'], 'location': face['location']}
+        if result['status'] == 'matched':
+            matched.append(dict(describe(result['student_id'], result['distance']), **position))
+        elif result['status'] == 'ambiguous':
+            ambiguous.append(dict(position, reason=result['reason'],
+                                  candidates=[describe(*c) for c in result['candidates']]))
+        else:
+            unmatched.append(position)
+    
+    existing = query_db(
+        'SELECT id, student_id FROM attendance WHERE session_id = ?', (session_id,)
+    )
+    already_marked = {row['student_id'] for row in existing}
+    last_id = max((row['id'] for row in existing), default=0)
+    new_ids = db_writer.run(insert_attendance, session_id, session['subject_id'],
+                            sorted({m['student_id'] for m in matched} - already_marked))
+    
+    if new_ids:
+        for row in fetch_attendance_since(session_id, last_id):
+            attendance_events.publish(session_id, {'type': 'attendance', 'row': row})
+    
+    for m in matched:
+        m['already_marked'] = m['student_id'] in already_marked
+    
+    return jsonify({
+        'marked': len(new_ids),
+        'faces': len(faces),
+        'matched': matched,
+        'unmatched': unmatched,
+        'ambiguous': ambiguous
+    })
+
 @app.route('/api/teacher/report', methods=['GET'])
 @token_required
 @role_required('teacher')
@@ -720,6 +1832,22 @@ def get_teacher_report(current_user):
     class_id = request.args.get('class_id')
     subject_id = request.args.get('subject_id')
     
+    # Optional inclusive date range over session start dates (YYYY-MM-DD)
+    filters, filter_args = '', []
+    try:
+        for arg, clause in (('date_from', " AND s.start_time >= ?"),
+                            ('date_to', " AND s.start_time < date(?, '+1 day')")):
+            value = request.args.get(arg)
+            if value:
+                datetime.date.fromisoformat(value)
+                filters += clause
+                filter_args.append(value)
+    except ValueError:
+        return jsonify({'message': 'Dates must be in YYYY-MM-DD format'}), 400
+    
+    if request.args.get('format') == 'matrix':
+        return jsonify(attendance_matrix(class_id, subject_id, filters, filter_args))
+    
     records = query_db('''
         SELECT s.start_time as date, u.name as student_name,
                CASE WHEN a.id IS NOT NULL THEN 'present' ELSE 'absent' END as status
@@ -727,12 +1855,87 @@ def get_teacher_report(current_user):
         CROSS JOIN students st
         JOIN users u ON st.user_id = u.id
         LEFT JOIN attendance a ON s.id = a.session_id AND st.id = a.student_id
-        WHERE s.class_id = ? AND s.subject_id = ? AND st.class_id = ?
+        WHERE s.class_id = ? AND s.subject_id = ? AND st.class_id = ?''' + filters + '''
         ORDER BY s.start_time DESC, u.name
-    ''', (class_id, subject_id, class_id))
+    ''', (class_id, subject_id, class_id, *filter_args))
     
     return jsonify({'records': records})
 
+def attendance_matrix(class_id, subject_id, filters, filter_args):
+    """Pivoted report: a student list, a page of sessions and one presence bitset per session.
+
+    Bit i of a session's 'present' bitset (base64, least significant bit
+    first within each byte) is set when students[i] attended. Only present
+    rows are read; absence is implied by a clear bit. Counts and totals come
+    from the attendance summary tables, or, within a date range, from the
+    attendance rows of the sessions in that range.
+    """
+    limit = min(max(request.args.get('limit', 100, type=int), 1), app.config['REPORT_MAX_SESSIONS'])
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    
+    students = query_db('''
+        SELECT st.id, u.name,
+               COALESCE(ss.present_count, 0) as present_total,
+               ss.last_attended_at
+        FROM students st
+        JOIN users u ON st.user_id = u.id
+        LEFT JOIN student_subject_stats ss ON ss.student_id = st.id AND ss.subject_id = ?
+        WHERE st.class_id = ?
+        ORDER BY u.name, st.id
+    ''', (subject_id, class_id))
+    position = {student['id']: i for i, student in enumerate(students)}
+    
+    where = 'WHERE s.class_id = ? AND s.subject_id = ?' + filters
+    args = (class_id, subject_id, *filter_args)
+    if filters:
+        total = query_db('SELECT COUNT(*) as count FROM sessions s ' + where, args, one=True)['count']
+        # The summary tables count every session ever held, not just this range
+        in_range = {row['student_id']: row for row in query_db('''
+            SELECT a.student_id, COUNT(*) as present_total, MAX(a.marked_at) as last_attended_at
+            FROM sessions s
+            JOIN attendance a ON a.session_id = s.id
+            ''' + where + '''
+            GROUP BY a.student_id
+        ''', args)}
+        for student in students:
+            row = in_range.get(student['id'])
+            student['present_total'] = row['present_total'] if row else 0
+            student['last_attended_at'] = row['last_attended_at'] if row else None
+    else:
+        total = query_db('''
+            SELECT COALESCE(MAX(sessions_held), 0) as count FROM class_subject_stats
+            WHERE class_id = ? AND subject_id = ?
+        ''', (class_id, subject_id), one=True)['count']
+    sessions = query_db('''
+        SELECT s.id, s.start_time as date, COALESCE(st.present_count, 0) as present_count
+        FROM sessions s
+        LEFT JOIN session_stats st ON st.session_id = s.id
+        ''' + where + '''
+        ORDER BY s.start_time DESC, s.id DESC
+        LIMIT ? OFFSET ?
+    ''', (*args, limit, offset))
+    
+    bitsets = {session['id']: bytearray((len(students) + 7) // 8) for session in sessions}
+    if sessions:
+        placeholders = ','.join('?' * len(sessions))
+        for row in get_db().execute(
+                'SELECT session_id, student_id FROM attendance WHERE session_id IN (' + placeholders + ')',
+                list(bitsets)):
+            i = position.get(row['student_id'])
+            if i is not None:
+                bitsets[row['session_id']][i >> 3] |= 1 << (i & 7)
+    
+    for session in sessions:
+        session['present'] = base64.b64encode(bitsets[session['id']]).decode('ascii')
+    
+    return {
+        'students': students,
+        'sessions': sessions,
+        'total_sessions': total,
+        'limit': limit,
+        'offset': offset
+    }
+
 # ============================================
 # API - STUDENT ENDPOINTS
 # ============================================
@@ -742,19 +1945,19 @@ def get_teacher_report(current_user):
 @role_required('student')
 def get_student_profile(current_user):
     student = query_db('''
-        SELECT s.id, u.name, u.email, c.name as class_name, s.face_registered
+        SELECT s.id, c.name as class_name, s.face_registered
         FROM students s
-        JOIN users u ON s.user_id = u.id
         JOIN classes c ON s.class_id = c.id
-        WHERE u.id = ?
-    ''', (current_user['user_id'],), one=True)
+        WHERE s.id = ?
+    ''', (current_user['student_id'],), one=True)
+    student['name'] = current_user['name']
+    student['email'] = current_user['email']
     
     subjects = query_db('''
         SELECT sub.name, sub.code
         FROM subjects sub
         WHERE sub.class_id = ?
-    ''', (query_db('SELECT class_id FROM students WHERE user_id = ?', 
-                   (current_user['user_id'],), one=True)['class_id'],))
+    ''', (current_user['class_id'],))
     
     student['subjects'] = subjects
     return jsonify(student)
@@ -763,51 +1966,36 @@ def get_student_profile(current_user):
 @token_required
 @role_required('student')
 def register_face(current_user):
-    data = request.json
-    image_data = data.get('image')
+    with face_stage_latency.time('register_face', 'upload'):
+        image, _fields = read_face_upload()
     
-    if not image_data:
+    if not image:
         return jsonify({'message': 'No image provided'}), 400
     
     try:
-        # Decode base64 image
-        image_data = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if image is None:
-            return jsonify({'message': 'Failed to decode image'}), 400
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        # Detect face and get encoding
-        face_locations = face_recognition.face_locations(rgb_image)
-        
-        if len(face_locations) == 0:
-            return jsonify({'message': 'No face detected'}), 400
-        
-        if len(face_locations) > 1:
-            return jsonify({'message': 'Multiple faces detected. Please ensure only one face is visible'}), 400
-        
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-        face_encoding = face_encodings[0]
+        # Detect face and get encoding in the face-processing pool
+        with face_stage_latency.time('register_face', 'face_job'):
+            result = face_pool.run(encode_single_face, image, face_options())
+        record_face_timings('register_face', result['timings'])
+        face_encoding = result['encoding']
         
         # Save encoding to database
-        encoding_str = ','.join(map(str, face_encoding))
-        
-        student = query_db('SELECT id FROM students WHERE user_id = ?', 
-                          (current_user['user_id'],), one=True)
+        encoding_blob = encode_face(face_encoding, app.config['FACE_ENCODING_DTYPE'])
         
-        conn = get_db()
-        conn.execute('''
-            UPDATE students 
-            SET face_encoding = ?, face_registered = 1 
-            WHERE id = ?
-        ''', (encoding_str, student['id']))
-        conn.commit()
-        conn.close()
+        with face_stage_latency.time('register_face', 'db'):
+            conn = get_db()
+            conn.execute('''
+                UPDATE students 
+                SET face_encoding = ?, face_registered = 1 
+                WHERE id = ?
+            ''', (encoding_blob, current_user['student_id']))
+            conn.commit()
+        encoding_store.invalidate(current_user['class_id'])
         
         return jsonify({'message': 'Face registered successfully'})
     
+    except (FaceValidationError, PoolBusyError, JobTimeoutError):
+        raise
     except Exception as e:
         return jsonify({'message': f'Error processing image: {str(e)}'}), 500
 
@@ -818,126 +2006,102 @@ def verify_session_code(current_user):
     data = request.json
     code = data.get('code')
     
-    student = query_db('SELECT class_id FROM students WHERE user_id = ?', 
-                      (current_user['user_id'],), one=True)
-    
-    session = query_db('''
-        SELECT s.id as session_id, s.class_id, c.name as class_name, 
-               sub.name as subject_name, sub.id as subject_id
-        FROM sessions s
-        JOIN classes c ON s.class_id = c.id
-        JOIN subjects sub ON s.subject_id = sub.id
-        WHERE s.code = ? AND s.is_active = 1
-        AND datetime(s.start_time, '+60 seconds') > datetime('now')
-    ''', (code,), one=True)
+    # Codes may start with zeros, so only strings are accepted
+    session = find_active_session(code=code) if code and isinstance(code, str) else None
     
     if not session:
         return jsonify({'message': 'Invalid code or session expired'}), 400
     
-    if session['class_id'] != student['class_id']:
+    if session['class_id'] != current_user['class_id']:
         return jsonify({'message': 'You are not eligible for this subject'}), 403
     
-    return jsonify(session)
+    return jsonify(public_session(session))
 
 @app.route('/api/student/mark-attendance', methods=['POST'])
 @token_required
 @role_required('student')
 def mark_attendance(current_user):
-    data = request.json
-    session_id = data.get('session_id')
-    image_data = data.get('image')
+    with face_stage_latency.time('mark_attendance', 'upload'):
+        image, fields = read_face_upload()
+    session_id = fields.get('session_id')
     
-    if not session_id or not image_data:
+    if not session_id or not image:
         return jsonify({'message': 'Missing required data'}), 400
     
+    # A JSON number, or digits from a form or query string
+    if not (type(session_id) is int or isinstance(session_id, str) and session_id.isascii()
+            and session_id.isdigit()):
+        return jsonify({'message': 'Invalid session'}), 400
+    session_id = int(session_id)
+    
     try:
-        # Get student info
-        student = query_db('''
-            SELECT id, face_encoding FROM students WHERE user_id = ?
-        ''', (current_user['user_id'],), one=True)
-        
-        if not student['face_encoding']:
-            return jsonify({'message': 'Face not registered'}), 400
-        
-        # Check if already marked
-        existing = query_db('''
-            SELECT id FROM attendance 
-            WHERE session_id = ? AND student_id = ?
-        ''', (session_id, student['id']), one=True)
+        student = {'id': current_user['student_id'], 'class_id': current_user['class_id'],
+                   'name': current_user['name'], 'email': current_user['email']}
         
-        if existing:
-            return jsonify({'message': 'Attendance already marked'}), 400
+        session = find_active_session(session_id=session_id,
+                                      grace=app.config['SESSION_SUBMIT_GRACE_SECONDS'])
+        error = submission_error(student, session)
+        if error:
+            return jsonify({'message': error[0]}), error[1]
         
-        # Decode and verify face
-        image_data = image_data.split(',')[1]
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-        if image is None:
-            return jsonify({'message': 'Failed to decode image'}), 400
-        rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        # Async mode: accept the selfie now and verify it in the background, so
+        # the connection is not held through face processing
+        if 'respond-async' in request.headers.get('Prefer', ''):
+            with face_stage_latency.time('mark_attendance', 'db'):
+                job_id = db_writer.run(enqueue_job, session_id, student['id'], image)
+            attendance_queue.start()
+            attendance_queue.notify()
+            status_url = f'/api/student/attendance-jobs/{job_id}'
+            return (jsonify({'job_id': job_id, 'status': 'pending', 'status_url': status_url}),
+                    202, {'Location': status_url, 'Preference-Applied': 'respond-async'})
         
-        face_locations = face_recognition.face_locations(rgb_image)
-        
-        if len(face_locations) == 0:
-            return jsonify({'message': 'No face detected'}), 400
-        
-        if len(face_locations) > 1:
-            return jsonify({'message': 'Multiple faces detected. Please ensure only one face is visible'}), 400
-        
-        face_encodings = face_recognition.face_encodings(rgb_image, face_locations)
-        
-        # Compare with stored encoding
-        stored_encoding = np.array([float(x) for x in student['face_encoding'].split(',')])
-        matches = face_recognition.compare_faces([stored_encoding], face_encodings[0], tolerance=0.4)
-        
-        if not matches[0]:
-            return jsonify({'message': 'Face verification failed'}), 400
-        
-        # Mark attendance
-        conn = get_db()
-        conn.execute('''
-            INSERT INTO attendance (session_id, student_id, status)
-            VALUES (?, ?, 'present')
-        ''', (session_id, student['id']))
-        conn.commit()
-        conn.close()
-        
-        return jsonify({'message': 'Attendance marked successfully'})
+        message, status = verify_and_mark(student, session, image, 'mark_attendance')
+        return jsonify({'message': message}), status
     
+    except (FaceValidationError, PoolBusyError, JobTimeoutError, WriteTimeoutError):
+        raise
     except Exception as e:
         return jsonify({'message': f'Error: {str(e)}'}), 500
 
+@app.route('/api/student/attendance-jobs/<int:job_id>', methods=['GET'])
+@token_required
+@role_required('student')
+def get_attendance_job(current_user, job_id):
+    status = attendance_job_status(get_db(), job_id, current_user['student_id'])
+    if status is None:
+        return jsonify({'message': 'Job not found'}), 404
+    return jsonify(status)
+
 @app.route('/api/student/attendance-report', methods=['GET'])
 @token_required
 @role_required('student')
 def get_student_attendance_report(current_user):
-    student = query_db('SELECT id, class_id FROM students WHERE user_id = ?', 
-                      (current_user['user_id'],), one=True)
-    
-    subjects = query_db('SELECT id, name, code FROM subjects WHERE class_id = ?', 
-                       (student['class_id'],))
-    
-    report = []
-    for subject in subjects:
-        total = query_db('''
-            SELECT COUNT(*) as count FROM sessions 
-            WHERE class_id = ? AND subject_id = ?
-        ''', (student['class_id'], subject['id']), one=True)['count']
-        
-        present = query_db('''
-            SELECT COUNT(*) as count FROM attendance a
-            JOIN sessions s ON a.session_id = s.id
-            WHERE s.class_id = ? AND s.subject_id = ? 
-            AND a.student_id = ?
-        ''', (student['class_id'], subject['id'], student['id']), one=True)['count']
-        
-        report.append({
-            'name': subject['name'],
-            'code': subject['code'],
-            'total': total,
-            'present': present
-        })
+    if app.config['REPORT_FROM_COUNTERS']:
+        # Maintained counters: one primary-key lookup per subject
+        report = query_db('''
+            SELECT sub.name, sub.code,
+                   COALESCE(cs.sessions_held, 0) as total,
+                   COALESCE(ss.present_count, 0) as present,
+                   ss.last_attended_at
+            FROM subjects sub
+            LEFT JOIN class_subject_stats cs ON cs.class_id = sub.class_id AND cs.subject_id = sub.id
+            LEFT JOIN student_subject_stats ss ON ss.student_id = ? AND ss.subject_id = sub.id
+            WHERE sub.class_id = ?
+            ORDER BY sub.id
+        ''', (current_user['student_id'], current_user['class_id']))
+    else:
+        report = query_db('''
+            SELECT sub.name, sub.code,
+                   COUNT(s.id) as total,
+                   COUNT(a.id) as present,
+                   MAX(a.marked_at) as last_attended_at
+            FROM subjects sub
+            LEFT JOIN sessions s ON s.class_id = sub.class_id AND s.subject_id = sub.id
+            LEFT JOIN attendance a ON a.session_id = s.id AND a.student_id = ?
+            WHERE sub.class_id = ?
+            GROUP BY sub.id
+            ORDER BY sub.id
+        ''', (current_user['student_id'], current_user['class_id']))
     
     return jsonify({'subjects': report})
 
@@ -946,5 +2110,10 @@ def get_student_attendance_report(current_user):
 # ============================================
 
 if __name__ == '__main__':
+    startup()
+    debug = os.environ.get('FLASK_ENV') != 'production'
+    # With the reloader, only the child process that serves requests runs them
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background()
     port = int(os.environ.get('PORT', 5001))
-    app.run(debug=os.environ.get('FLASK_ENV') != 'production', host='0.0.0.0', port=port)
\ No newline at end of file
+    app.run(debug=debug, host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,184 @@
+"""
+Smart Attendance System - Attendance Job Queue
+SQLite-backed queue of attendance selfies verified in the background
+
+A submission is checked and stored as a job straight away, so the request
+returns before any face processing. Worker threads in each web process
+claim jobs in arrival order; a job whose worker died is claimed again once
+it is stale, until it has been claimed MAX_ATTEMPTS times. Jobs are not re-checked against the session's expiry: a
+selfie accepted in time counts however late it is processed.
+
+The functions that change jobs run inside a write transaction opened by
+the caller and do not commit.
+"""
+
+import logging
+import threading
+import time
+from worker_pool import PoolBusyError
+
+logger = logging.getLogger(__name__)
+
+# Idle workers look for jobs submitted to other processes this often
+POLL_SECONDS = 1.0
+# Jobs that failed this many times are answered with an error
+MAX_ATTEMPTS = 3
+STALE_MESSAGE = 'Error: verification did not finish, please try again'
+
+
+def enqueue_job(conn, session_id, student_id, image):
+    """Store a submission; returns the job id"""
+    cursor = conn.execute('''
+        INSERT INTO attendance_jobs (session_id, student_id, image, submitted_at)
+        VALUES (?, ?, ?, ?)
+    ''', (session_id, student_id, image, time.time()))
+    return cursor.lastrowid
+
+
+def has_work(conn, stale_after):
+    """Whether a job is waiting or a stale one can be reclaimed (read-only check)"""
+    return conn.execute('''
+        SELECT EXISTS (SELECT 1 FROM attendance_jobs WHERE status = 'pending')
+            OR EXISTS (SELECT 1 FROM attendance_jobs WHERE status = 'running' AND claimed_at < ?)
+    ''', (time.time() - stale_after,)).fetchone()[0]
+
+
+def claim_job(conn, stale_after):
+    """Take the oldest pending job, or None; returns the job as a dict with its image"""
+    now = time.time()
+    # Every claim counts an attempt, so a job that keeps killing its worker
+    # is answered with an error instead of being reclaimed forever
+    conn.execute('''
+        UPDATE attendance_jobs
+        SET status = 'done', status_code = 500, message = ?, image = NULL, finished_at = ?
+        WHERE status = 'running' AND claimed_at < ? AND attempts >= ?
+    ''', (STALE_MESSAGE, now, now - stale_after, MAX_ATTEMPTS))
+    conn.execute('''
+        UPDATE attendance_jobs SET status = 'pending'
+        WHERE status = 'running' AND claimed_at < ?
+    ''', (now - stale_after,))
+    job = conn.execute('''
+        SELECT id FROM attendance_jobs WHERE status = 'pending' ORDER BY id LIMIT 1
+    ''').fetchone()
+    if job is None:
+        return None
+    conn.execute('''
+        UPDATE attendance_jobs SET status = 'running', claimed_at = ?, attempts = attempts + 1
+        WHERE id = ?
+    ''', (now, job['id']))
+    return dict(conn.execute('SELECT * FROM attendance_jobs WHERE id = ?', (job['id'],)).fetchone())
+
+
+def requeue_job(conn, job_id, failed=True):
+    """Put a claimed job back; unless it failed, its claim does not count as an attempt"""
+    conn.execute('''
+        UPDATE attendance_jobs SET status = 'pending', attempts = attempts - ?
+        WHERE id = ?
+    ''', (0 if failed else 1, job_id))
+
+
+def finish_job(conn, job_id, status_code, message):
+    """Record a job's outcome and drop its image"""
+    conn.execute('''
+        UPDATE attendance_jobs
+        SET status = 'done', status_code = ?, message = ?, image = NULL, finished_at = ?
+        WHERE id = ?
+    ''', (status_code, message, time.time(), job_id))
+
+
+def job_status(conn, job_id, student_id):
+    """Progress or outcome of one of a student's jobs, or None"""
+    job = conn.execute('''
+        SELECT id, status, status_code, message, submitted_at, finished_at
+        FROM attendance_jobs WHERE id = ? AND student_id = ?
+    ''', (job_id, student_id)).fetchone()
+    if job is None:
+        return None
+    status = dict(job)
+    if job['status'] == 'pending':
+        status['position'] = conn.execute('''
+            SELECT COUNT(*) FROM attendance_jobs WHERE status = 'pending' AND id < ?
+        ''', (job_id,)).fetchone()[0]
+    return status
+
+
+def purge_jobs(conn, older_than):
+    """Delete finished jobs finished more than ``older_than`` seconds ago"""
+    cursor = conn.execute("DELETE FROM attendance_jobs WHERE status = 'done' AND finished_at < ?",
+                          (time.time() - older_than,))
+    return cursor.rowcount
+
+
+class AttendanceQueue:
+    """Worker threads draining attendance_jobs.
+
+    ``process(job)`` verifies one job and returns (status code, message).
+    A busy face pool puts the job back, without counting an attempt, and the
+    worker waits before claiming again; any other exception counts as a
+    failed attempt. ``write(fn, *args)`` applies one of
+    the job functions above in a transaction and returns its result;
+    ``connect()`` opens the connection idle workers use to look for jobs.
+    """
+
+    def __init__(self, connect, write, process, workers=2, stale_after=60, retention=3600):
+        self.connect = connect
+        self.write = write
+        self.process = process
+        self.workers = workers
+        self.stale_after = stale_after
+        self.retention = retention
+        self._wake = threading.Condition()
+        self._started = False
+        self._last_purge = 0.0
+
+    def start(self):
+        """Start this process's worker threads (once)"""
+        with self._wake:
+            if self._started:
+                return
+            self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f'attendance-queue-{i}', daemon=True).start()
+
+    def notify(self):
+        """Wake a worker for a job submitted by this process"""
+        with self._wake:
+            self._wake.notify()
+
+    def _worker(self):
+        conn = self.connect()
+        while True:
+            try:
+                job = self.write(claim_job, self.stale_after) if has_work(conn, self.stale_after) else None
+                if job is None:
+                    self._maybe_purge()
+                    with self._wake:
+                        self._wake.wait(POLL_SECONDS)
+                    continue
+                self._run(job)
+            except Exception:
+                logger.exception('Attendance queue worker error')
+                time.sleep(POLL_SECONDS)
+
+    def _run(self, job):
+        try:
+            status_code, message = self.process(job)
+        except PoolBusyError as e:
+            # Synchronous requests hold the face pool. Do not hold the job
+            # while waiting: once stale it would be claimed and run again
+            self.write(requeue_job, job['id'], False)
+            time.sleep(e.retry_after)
+            return
+        except Exception as e:
+            logger.exception('Attendance job %s failed', job['id'])
+            if job['attempts'] < MAX_ATTEMPTS:
+                self.write(requeue_job, job['id'])
+                return
+            status_code, message = 500, f'Error: {e}'
+        self.write(finish_job, job['id'], status_code, message)
+
+    def _maybe_purge(self):
+        now = time.monotonic()
+        if now - self._last_purge >= 60:
+            self._last_purge = now
+            self.write(purge_jobs, self.retention)
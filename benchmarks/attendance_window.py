@@ -0,0 +1,361 @@
+"""
+Smart Attendance System - Attendance Window Benchmark
+Replays a class attendance window against a seeded database
+
+Every class's teacher starts a session and polls the live attendance list
+while the students arrive spread over --window seconds. Each student logs
+in, enters the session code and submits a selfie, so the flow is
+login -> verify-code -> mark-attendance. Latency, throughput and error rate
+are reported per endpoint.
+
+Runs offline against a temporary SQLite database through Flask's test
+client. Faces use the stub backend (FACE_BACKEND=stub), so the numbers
+cover HTTP, auth, pools and database work rather than face detection.
+Each student's synthetic selfie is a small JPEG.
+
+    python benchmarks/attendance_window.py --classes 10 --students 60 --concurrency 32
+    python benchmarks/attendance_window.py --json benchmarks/results/$(git rev-parse --short HEAD).json
+
+With --async, selfies are submitted with `Prefer: respond-async` and each
+student polls the job; 'attendance-job' then reports submission to verdict.
+
+Against a running server, seed a database first and start the server on it
+with the stub backend:
+
+    python benchmarks/attendance_window.py --seed-only --database /tmp/bench.db --classes 10 --students 60
+    DATABASE=/tmp/bench.db FACE_BACKEND=stub SESSION_DURATION_SECONDS=120 gunicorn app:app
+    python benchmarks/attendance_window.py --url http://localhost:8000 --classes 10 --students 60
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, Recorder, print_summary, write_results
+
+PASSWORD = 'bench-password'
+
+
+def teacher_email(c):
+    return f'bench-teacher-{c}@bench.local'
+
+
+def student_email(c, s):
+    return f'bench-{c}-{s}@bench.local'
+
+
+def student_image(c, s):
+    """A deterministic 640x480 JPEG per student; the stub backend matches equal bytes"""
+    import cv2
+    import numpy as np
+    image = np.zeros((480, 640, 3), np.uint8)
+    image[:] = np.linspace(40, 200, 640, dtype=np.uint8)[None, :, None]
+    rng = random.Random(c * 100003 + s)
+    color = tuple(rng.randrange(256) for _ in range(3))
+    cv2.ellipse(image, (320, 220), (110, 150), 0, 0, 360, color, -1)
+    cv2.putText(image, f'{c}-{s}', (250, 450), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
+
+
+# ============================================
+# SEEDING
+# ============================================
+
+def import_app(database, hash_method):
+    """Import the application on `database` with the stub face backend"""
+    os.environ['DATABASE'] = database
+    os.environ.setdefault('FACE_BACKEND', 'stub')
+    if hash_method is not None:
+        os.environ['PASSWORD_HASH_METHOD'] = hash_method
+    sys.path.insert(0, ROOT)
+    import app as attendance_app
+    attendance_app.startup()
+    return attendance_app
+
+
+def seed(attendance_app, classes, students):
+    """Create the classes, one teacher and subject each, and registered students"""
+    from face_engine import stub_encoding
+    from face_store import encode_face
+    from passwords import hash_password
+
+    config = attendance_app.app.config
+    hashed = hash_password(PASSWORD, config['PASSWORD_HASH_METHOD'])
+    conn = attendance_app.connect_db()
+
+    for c in range(classes):
+        class_id = conn.execute('INSERT INTO classes (name) VALUES (?)', (f'BENCH-{c:03d}',)).lastrowid
+        subject_id = conn.execute('INSERT INTO subjects (class_id, name, code) VALUES (?, ?, ?)',
+                                  (class_id, f'Bench subject {c}', f'B{c:03d}')).lastrowid
+        user_id = conn.execute("INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, 'teacher')",
+                               (teacher_email(c), hashed, f'Bench teacher {c}')).lastrowid
+        teacher_id = conn.execute('INSERT INTO teachers (user_id) VALUES (?)', (user_id,)).lastrowid
+        conn.execute('INSERT INTO teacher_subjects (teacher_id, subject_id, class_id) VALUES (?, ?, ?)',
+                     (teacher_id, subject_id, class_id))
+
+        for s in range(students):
+            user_id = conn.execute("INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, 'student')",
+                                   (student_email(c, s), hashed, f'Bench student {c}-{s}')).lastrowid
+            encoding = encode_face(stub_encoding(student_image(c, s)), config['FACE_ENCODING_DTYPE'])
+            conn.execute('''
+                INSERT INTO students (user_id, class_id, face_encoding, face_registered)
+                VALUES (?, ?, ?, 1)
+            ''', (user_id, class_id, encoding))
+        conn.commit()
+    conn.close()
+    # The rows were written behind the app's back; publish them to the shared store
+    attendance_app.encoding_store.rebuild()
+
+
+# ============================================
+# CLIENTS
+# ============================================
+
+class LocalClient:
+    """Requests through Flask's test client, one client per thread"""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, token=None, body=None, content_type=None, headers=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        headers = dict(headers or {})
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        response = client.open(path, method=method, headers=headers, data=body, content_type=content_type)
+        return response.status_code, response.get_json(silent=True)
+
+
+class HttpClient:
+    """Requests to a running server over one keep-alive connection per thread"""
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlsplit(url)
+        self.host = parsed.netloc
+        self.https = parsed.scheme == 'https'
+        self._local = threading.local()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            connection = self._local.connection = cls(self.host, timeout=120)
+        return connection
+
+    def request(self, method, path, token=None, body=None, content_type=None, headers=None):
+        headers = dict(headers or {})
+        if token:
+            headers['Authorization'] = 'Bearer ' + token
+        if content_type:
+            headers['Content-Type'] = content_type
+        try:
+            connection = self._connection()
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self._local.connection = None
+            return 599, None
+        try:
+            return response.status, json.loads(data)
+        except ValueError:
+            return response.status, None
+
+
+def timed(recorder, endpoint, client, *args, **kwargs):
+    start = time.perf_counter()
+    status, body = client.request(*args, **kwargs)
+    recorder.record(endpoint, time.perf_counter() - start, status)
+    return status, body
+
+
+def post_json(payload):
+    return {'body': json.dumps(payload), 'content_type': 'application/json'}
+
+
+def wait_for_job(recorder, client, url, token, interval):
+    """Poll an attendance job until it is done; returns its status code"""
+    while True:
+        time.sleep(interval)
+        status, job = timed(recorder, 'job-status', client, 'GET', url, token)
+        if status != 200:
+            return status
+        if job['status'] == 'done':
+            return job['status_code']
+
+
+# ============================================
+# WINDOW
+# ============================================
+
+def run_window(client, args):
+    recorder = Recorder()
+
+    # Teachers open one session per class
+    sessions = {}
+    for c in range(args.classes):
+        status, body = timed(recorder, 'login', client, 'POST', '/api/login',
+                             **post_json({'email': teacher_email(c), 'password': PASSWORD}))
+        if status != 200:
+            raise SystemExit(f'Teacher login failed ({status}); is the database seeded with these sizes?')
+        token = body['token']
+        _status, assignments = client.request('GET', '/api/teacher/classes-subjects', token)
+        assignment = assignments[0]
+        status, body = timed(recorder, 'start-session', client, 'POST', '/api/teacher/start-session', token,
+                             **post_json({'class_id': assignment['class_id'],
+                                          'subject_id': assignment['subject_id']}))
+        if status != 201:
+            raise SystemExit(f'Could not start a session ({status}): {body}')
+        sessions[c] = {'id': body['id'], 'code': body['code'], 'token': token}
+
+    stop = threading.Event()
+    seen = {c: 0 for c in sessions}
+
+    def poll(c):
+        session, cursor = sessions[c], 0
+        while not stop.wait(args.poll_interval):
+            status, rows = timed(recorder, 'attendance-poll', client, 'GET',
+                                 f"/api/teacher/session/{session['id']}/attendance?since={cursor}",
+                                 session['token'])
+            if status == 200 and rows:
+                cursor = rows[-1]['id']
+                seen[c] += len(rows)
+
+    pollers = [threading.Thread(target=poll, args=(c,), daemon=True) for c in sessions]
+    for poller in pollers:
+        poller.start()
+
+    students = [(c, s) for c in range(args.classes) for s in range(args.students)]
+    random.Random(args.seed).shuffle(students)
+    lags, marked = [], []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def attend(index, c, s):
+        due = started + args.window * index / len(students)
+        time.sleep(max(0.0, due - time.perf_counter()))
+        lag = time.perf_counter() - due
+        image = student_image(c, s)
+        session = sessions[c]
+
+        status, body = timed(recorder, 'login', client, 'POST', '/api/login',
+                             **post_json({'email': student_email(c, s), 'password': PASSWORD}))
+        ok = status == 200
+        if ok:
+            token = body['token']
+            status, _body = timed(recorder, 'verify-code', client, 'POST', '/api/student/verify-code', token,
+                                  **post_json({'code': session['code']}))
+            ok = status == 200
+        if ok:
+            submitted = time.perf_counter()
+            status, body = timed(recorder, 'mark-attendance', client, 'POST',
+                                 f"/api/student/mark-attendance?session_id={session['id']}", token,
+                                 body=image, content_type='image/jpeg',
+                                 headers={'Prefer': 'respond-async'} if args.async_mode else None)
+            if status == 202:
+                # Submission to verdict, including the time spent queued
+                status = wait_for_job(recorder, client, body['status_url'], token, args.job_poll_interval)
+                recorder.record('attendance-job', time.perf_counter() - submitted, status)
+            ok = status == 200
+        with lock:
+            lags.append(lag)
+            if ok:
+                marked.append((c, s))
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        for future in [executor.submit(attend, index, c, s) for index, (c, s) in enumerate(students)]:
+            future.result()
+    wall = time.perf_counter() - started
+
+    # One last poll per class so every mark is seen, then close the sessions
+    stop.set()
+    for poller in pollers:
+        poller.join()
+    for c, session in sessions.items():
+        _status, rows = client.request('GET', f"/api/teacher/session/{session['id']}/attendance", session['token'])
+        seen[c] = len(rows or [])
+        timed(recorder, 'end-session', client, 'POST', f"/api/teacher/session/{session['id']}/end",
+              session['token'])
+
+    return {
+        'wall_seconds': round(wall, 3),
+        'students': {
+            'scheduled': len(students),
+            'marked': len(marked),
+            'seen_by_teachers': sum(seen.values()),
+            'max_start_lag_seconds': round(max(lags, default=0.0), 3)
+        },
+        'endpoints': recorder.summary(wall)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--classes', type=int, default=5, help='classes, each with one teacher and session')
+    parser.add_argument('--students', type=int, default=40, help='students per class')
+    parser.add_argument('--concurrency', type=int, default=16, help='students in flight at once')
+    parser.add_argument('--window', type=float, default=60, help='seconds over which students arrive')
+    parser.add_argument('--poll-interval', type=float, default=2, help='seconds between teacher polls')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the arrival order')
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help='submit selfies with Prefer: respond-async and poll the job')
+    parser.add_argument('--job-poll-interval', type=float, default=0.25,
+                        help='seconds between job status polls with --async')
+    parser.add_argument('--hash-method', help='PASSWORD_HASH_METHOD for seeded accounts (default: app default)')
+    parser.add_argument('--database', help='database to seed (default: a temporary file)')
+    parser.add_argument('--seed-only', action='store_true', help='seed --database and exit')
+    parser.add_argument('--url', help='benchmark a running server seeded with the same sizes')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    pools = []
+    if args.url:
+        client = HttpClient(args.url)
+        face_backend = 'server'
+    else:
+        if args.seed_only and not args.database:
+            parser.error('--seed-only needs --database')
+        database = args.database or os.path.join(tempfile.mkdtemp(prefix='attendance-bench-'), 'attendance.db')
+        # Sessions must stay open for the whole window
+        os.environ.setdefault('SESSION_DURATION_SECONDS', str(int(args.window) + 60))
+        attendance_app = import_app(database, args.hash_method)
+        face_backend = attendance_app.app.config['FACE_BACKEND']
+        started = time.perf_counter()
+        seed(attendance_app, args.classes, args.students)
+        print(f'Seeded {args.classes} classes x {args.students} students into {database} '
+              f'in {time.perf_counter() - started:.1f}s')
+        if args.seed_only:
+            return
+        client = LocalClient(attendance_app.app)
+        pools = [attendance_app.face_pool, attendance_app.password_pool]
+
+    try:
+        results = run_window(client, args)
+    finally:
+        for pool in pools:
+            pool.shutdown()
+
+    print(f"\n{results['students']['marked']}/{results['students']['scheduled']} students marked in "
+          f"{results['wall_seconds']}s (face backend: {face_backend}, "
+          f"max start lag {results['students']['max_start_lag_seconds']}s)\n")
+    print_summary(results['endpoints'])
+
+    if args.json:
+        config = dict(vars(args), face_backend=face_backend)
+        write_results(args.json, 'attendance_window', config, results)
+        print(f'\nResults written to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
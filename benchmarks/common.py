@@ -0,0 +1,91 @@
+"""
+Smart Attendance System - Benchmark Helpers
+Latency recording, summaries and result files shared by the benchmark scripts
+"""
+
+import json
+import os
+import subprocess
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+class Recorder:
+    """Latencies and status codes per endpoint, safe to share between threads"""
+
+    def __init__(self):
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, seconds, status):
+        with self._lock:
+            self._samples.setdefault(endpoint, []).append((seconds, status))
+
+    def summary(self, wall_seconds):
+        """Per-endpoint counts, error rate, throughput and latency percentiles (ms)"""
+        with self._lock:
+            samples = {endpoint: list(values) for endpoint, values in self._samples.items()}
+
+        summary = {}
+        for endpoint, values in samples.items():
+            latencies = sorted(seconds for seconds, _status in values)
+            statuses = {}
+            for _seconds, status in values:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+            errors = sum(1 for _seconds, status in values if status >= 400)
+            summary[endpoint] = {
+                'requests': len(values),
+                'errors': errors,
+                'error_rate': round(errors / len(values), 4),
+                'throughput_rps': round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+                'p50_ms': round(percentile(latencies, 50) * 1000, 1),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 1),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 1),
+                'max_ms': round(latencies[-1] * 1000, 1),
+                'status_codes': dict(sorted(statuses.items()))
+            }
+        return summary
+
+
+def print_summary(summary):
+    print(f"{'endpoint':<20}{'requests':>9}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for endpoint, stats in summary.items():
+        print(f"{endpoint:<20}{stats['requests']:>9}{stats['errors']:>8}{stats['throughput_rps']:>9}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+
+def git_revision():
+    """Short commit id of the tree being measured, with '+dirty' for local changes"""
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return revision + ('+dirty' if dirty else '')
+
+
+def write_results(path, name, config, results):
+    """Save results with the commit and time they were measured at"""
+    document = {
+        'benchmark': name,
+        'commit': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': config,
+        **results
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
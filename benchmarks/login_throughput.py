@@ -0,0 +1,138 @@
+"""
+Smart Attendance System - Login Throughput Benchmark
+Measures logins/sec at the configured PASSWORD_HASH_METHOD
+
+Runs against a throwaway database through Flask's test client, or against a
+running server with --url (the accounts must already exist there).
+
+    python benchmarks/login_throughput.py --users 200 --concurrency 8
+    PASSWORD_HASH_METHOD=pbkdf2:sha256:600000 python benchmarks/login_throughput.py
+    python benchmarks/login_throughput.py --url http://localhost:5001 --email admin@smart.edu --password admin123
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from common import ROOT, Recorder, write_results
+
+
+def local_client(users):
+    """Create `users` student accounts in a temporary database; returns (post, credentials, method, pool)"""
+    os.environ.setdefault('DATABASE', os.path.join(tempfile.mkdtemp(prefix='login-bench-'), 'attendance.db'))
+    sys.path.insert(0, ROOT)
+    import app as attendance_app
+    from passwords import hash_passwords
+    attendance_app.startup()
+
+    method = attendance_app.app.config['PASSWORD_HASH_METHOD']
+    conn = attendance_app.connect_db()
+    conn.execute("INSERT OR IGNORE INTO classes (name) VALUES ('BENCH')")
+    class_id = conn.execute("SELECT id FROM classes WHERE name = 'BENCH'").fetchone()['id']
+    credentials = [(f'bench{i}@example.com', f'password-{i}') for i in range(users)]
+    hashes = attendance_app.password_pool.run(hash_passwords, [p for _e, p in credentials], method)
+    conn.executemany("INSERT OR IGNORE INTO users (email, password, name, role) VALUES (?, ?, ?, 'student')",
+                     [(email, hashed, email) for (email, _p), hashed in zip(credentials, hashes)])
+    conn.execute('''
+        INSERT OR IGNORE INTO students (user_id, class_id)
+        SELECT id, ? FROM users WHERE email LIKE 'bench%@example.com'
+    ''', (class_id,))
+    conn.commit()
+    conn.close()
+
+    local = threading.local()
+
+    def post(email, password):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = attendance_app.app.test_client()
+        return client.post('/api/login', json={'email': email, 'password': password}).status_code
+
+    return post, credentials, method, attendance_app.password_pool
+
+
+def remote_client(url):
+    def post(email, password):
+        request = urllib.request.Request(
+            url.rstrip('/') + '/api/login',
+            data=json.dumps({'email': email, 'password': password}).encode(),
+            headers={'Content-Type': 'application/json'}
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return post
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100, help='accounts to create (local mode)')
+    parser.add_argument('--logins', type=int, default=500, help='total login requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--url', help='benchmark a running server instead')
+    parser.add_argument('--email', help='account used in --url mode')
+    parser.add_argument('--password', help='password used in --url mode')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    pool = None
+    if args.url:
+        if not args.email or not args.password:
+            parser.error('--url needs --email and --password')
+        post = remote_client(args.url)
+        credentials = [(args.email, args.password)]
+        method = os.environ.get('PASSWORD_HASH_METHOD', '') or 'server default'
+    else:
+        post, credentials, method, pool = local_client(args.users)
+
+    # One warm-up login per client so pool start-up is not measured
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(lambda c: post(*c), credentials[:args.concurrency]))
+
+    recorder = Recorder()
+
+    def login(i):
+        email, password = credentials[i % len(credentials)]
+        start = time.perf_counter()
+        status = post(email, password)
+        recorder.record('login', time.perf_counter() - start, status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        list(executor.map(login, range(args.logins)))
+    wall = time.perf_counter() - started
+
+    if pool is not None:
+        pool.shutdown()
+
+    stats = recorder.summary(wall)['login']
+    ok = stats['status_codes'].get('200', 0)
+    results = {
+        'hash_method': method or 'werkzeug default',
+        'logins': args.logins,
+        'concurrency': args.concurrency,
+        'seconds': round(wall, 3),
+        'logins_per_second': round(ok / wall, 2),
+        'p50_ms': stats['p50_ms'],
+        'p95_ms': stats['p95_ms'],
+        'p99_ms': stats['p99_ms'],
+        'status_codes': stats['status_codes']
+    }
+
+    for key, value in results.items():
+        print(f'{key:>18}: {value}')
+    if args.json:
+        write_results(args.json, 'login_throughput', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
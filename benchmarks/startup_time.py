@@ -0,0 +1,91 @@
+"""
+Smart Attendance System - Startup Time Benchmark
+Measures what a fresh process pays before it can serve requests
+
+Each phase runs in new interpreters (--repeat times) and the median is
+reported:
+
+    import_app        importing app.py (no database or face stack work)
+    startup_new_db    app.startup() creating and migrating a new database
+    startup           app.startup() on an existing database
+    face_stack        importing OpenCV and face_recognition (dlib models)
+    warm_up           app.warm_up(): encoding cache plus face pool workers loaded
+
+    python benchmarks/startup_time.py --repeat 5 --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from common import ROOT, write_results
+
+PROBE = r'''
+import json, os, sys, time
+sys.path.insert(0, os.environ['BENCH_ROOT'])
+timings = {}
+start = time.perf_counter()
+import app
+timings['import_app'] = time.perf_counter() - start
+start = time.perf_counter()
+app.startup()
+timings[os.environ['BENCH_STARTUP_PHASE']] = time.perf_counter() - start
+if os.environ.get('BENCH_FACE_STACK') == '1':
+    from face_engine import load_face_stack
+    start = time.perf_counter()
+    try:
+        load_face_stack()
+        timings['face_stack'] = time.perf_counter() - start
+    except ImportError:
+        pass
+if os.environ.get('BENCH_WARM_UP') == '1':
+    start = time.perf_counter()
+    app.warm_up()
+    timings['warm_up'] = time.perf_counter() - start
+    app.face_pool.shutdown()
+print(json.dumps(timings))
+'''
+
+
+def probe(database, startup_phase, face_stack=False, warm_up=False):
+    env = dict(os.environ, BENCH_ROOT=ROOT, DATABASE=database, BENCH_STARTUP_PHASE=startup_phase,
+               BENCH_FACE_STACK='1' if face_stack else '0', BENCH_WARM_UP='1' if warm_up else '0')
+    output = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='fresh processes per phase')
+    parser.add_argument('--skip-warm-up', action='store_true', help='do not start face pool workers')
+    parser.add_argument('--json', help='write the results to this file')
+    args = parser.parse_args()
+
+    samples = {}
+    directory = tempfile.mkdtemp(prefix='startup-bench-')
+    for i in range(args.repeat):
+        database = os.path.join(directory, f'attendance-{i}.db')
+        runs = [
+            probe(database, 'startup_new_db'),
+            probe(database, 'startup', face_stack=True),
+            probe(database, 'startup', warm_up=not args.skip_warm_up),
+        ]
+        for timings in runs:
+            for phase, seconds in timings.items():
+                samples.setdefault(phase, []).append(seconds)
+
+    results = {'phases_ms': {phase: round(statistics.median(values) * 1000, 1)
+                             for phase, values in samples.items()}}
+    for phase, ms in results['phases_ms'].items():
+        print(f'{phase:>16}: {ms} ms')
+    if args.json:
+        write_results(args.json, 'startup_time', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
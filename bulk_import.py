@@ -0,0 +1,312 @@
+"""
+Smart Attendance System - Bulk Import
+Parsing, validation and chunked insertion of student and teacher rows
+"""
+
+import csv
+import io
+import sqlite3
+from collections import deque
+from passwords import hash_passwords
+from worker_pool import PoolBusyError
+
+IMPORT_KINDS = ('students', 'teachers')
+
+# Placeholders per IN (...) lookup, well below SQLite's variable limit
+LOOKUP_CHUNK = 500
+
+
+class BulkImportError(Exception):
+    """Raised when an import payload cannot be read at all"""
+
+
+# ============================================
+# PARSING
+# ============================================
+
+def parse_csv(text):
+    """Rows of a CSV file with a header line, as dicts with lower-case keys"""
+    reader = csv.DictReader(io.StringIO(text))
+    if not reader.fieldnames:
+        raise BulkImportError('CSV file is empty')
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    return [{key: (value or '').strip() for key, value in row.items() if key}
+            for row in reader]
+
+
+def normalize_rows(rows):
+    """Validate JSON rows and strip string values"""
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise BulkImportError('Rows must be a list of objects')
+    return [{key.lower(): value.strip() if isinstance(value, str) else value
+             for key, value in row.items()} for row in rows]
+
+
+# ============================================
+# PASSWORD HASHING
+# ============================================
+
+def hash_in_pool(pool, passwords, method=None, batch_size=32):
+    """Hash passwords in batches on a BoundedProcessPool, preserving order.
+
+    At most ``pool.max_workers`` batches are in flight, so a large import
+    keeps every worker busy without filling the pool's queue; the pool stays
+    available to other requests.
+    """
+    hashes = []
+    in_flight = deque()
+    for start in range(0, len(passwords), batch_size):
+        batch = passwords[start:start + batch_size]
+        while True:
+            if len(in_flight) < pool.max_workers:
+                try:
+                    in_flight.append(pool.submit(hash_passwords, batch, method))
+                    break
+                except PoolBusyError:
+                    if not in_flight:
+                        raise
+            hashes.extend(pool.result(in_flight.popleft()))
+    while in_flight:
+        hashes.extend(pool.result(in_flight.popleft()))
+    return hashes
+
+
+# ============================================
+# LOOKUPS
+# ============================================
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _class_lookup(conn):
+    """Map lower-case class names and str(id) to class ids"""
+    lookup = {}
+    for row in conn.execute('SELECT id, name FROM classes'):
+        lookup[row['name'].lower()] = row['id']
+        lookup[str(row['id'])] = row['id']
+    return lookup
+
+
+def _resolve_class(classes, row, default_class_id):
+    value = row.get('class_id') or row.get('class') or default_class_id
+    if value is None or value == '':
+        return None
+    return classes.get(str(value).strip().lower())
+
+
+def _existing_users(conn, emails):
+    """Map email to role for accounts that already exist"""
+    existing = {}
+    for chunk in _chunks(list(emails), LOOKUP_CHUNK):
+        placeholders = ','.join('?' * len(chunk))
+        for row in conn.execute(f'SELECT email, role FROM users WHERE email IN ({placeholders})', chunk):
+            existing[row['email']] = row['role']
+    return existing
+
+
+def _insert_chunk(conn, items, insert_many, insert_one, errors):
+    """Insert a chunk in one transaction, falling back to row by row.
+
+    Returns the items that were inserted. A conflict that validation could
+    not see (for example an account created concurrently) rolls back the
+    batch; the rows are then retried one at a time under savepoints so that
+    only the offending rows are reported.
+    """
+    try:
+        insert_many(items)
+        conn.commit()
+        return items
+    except sqlite3.IntegrityError:
+        conn.rollback()
+
+    inserted = []
+    for item in items:
+        conn.execute('SAVEPOINT import_row')
+        try:
+            insert_one(item)
+            inserted.append(item)
+        except sqlite3.IntegrityError as e:
+            conn.execute('ROLLBACK TO import_row')
+            message = 'Email already exists' if 'users.email' in str(e) else str(e)
+            errors.extend({'row': number, 'email': item['email'], 'message': message}
+                          for number in item['rows'])
+        conn.execute('RELEASE import_row')
+    conn.commit()
+    return inserted
+
+
+# ============================================
+# STUDENTS
+# ============================================
+
+def import_students(conn, rows, hash_fn, chunk_size=500, default_class_id=None):
+    """Create student accounts; returns {'created', 'errors'}.
+
+    Rows need name, email, password and class (name or id, or class_id);
+    default_class_id applies to rows without a class. hash_fn maps a list of
+    passwords to a list of hashes.
+    """
+    errors = []
+    classes = _class_lookup(conn)
+    valid = []
+    seen = set()
+
+    for number, row in enumerate(rows, 1):
+        name = str(row.get('name') or '').strip()
+        email = str(row.get('email') or '').strip()
+        password = str(row.get('password') or '')
+        class_id = _resolve_class(classes, row, default_class_id)
+
+        if not name or not email or not password:
+            errors.append({'row': number, 'email': email, 'message': 'Name, email and password are required'})
+        elif class_id is None:
+            errors.append({'row': number, 'email': email, 'message': 'Unknown class'})
+        elif email in seen:
+            errors.append({'row': number, 'email': email, 'message': 'Duplicate email in file'})
+        else:
+            seen.add(email)
+            valid.append({'rows': [number], 'name': name, 'email': email,
+                          'password': password, 'class_id': class_id})
+
+    existing = _existing_users(conn, seen)
+    for item in valid:
+        if item['email'] in existing:
+            errors.append({'row': item['rows'][0], 'email': item['email'], 'message': 'Email already exists'})
+    valid = [item for item in valid if item['email'] not in existing]
+
+    for item, hashed in zip(valid, hash_fn([item['password'] for item in valid])):
+        item['password'] = hashed
+
+    def insert_many(items):
+        conn.executemany(
+            "INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, 'student')",
+            [(item['email'], item['password'], item['name']) for item in items]
+        )
+        conn.executemany(
+            'INSERT INTO students (user_id, class_id) SELECT id, ? FROM users WHERE email = ?',
+            [(item['class_id'], item['email']) for item in items]
+        )
+
+    def insert_one(item):
+        insert_many([item])
+
+    created = 0
+    for chunk in _chunks(valid, chunk_size):
+        created += len(_insert_chunk(conn, chunk, insert_many, insert_one, errors))
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'errors': errors}
+
+
+# ============================================
+# TEACHERS
+# ============================================
+
+def _subject_lookup(conn):
+    """Map (class_id, lower-case code, name or str(id)) to subject ids"""
+    lookup = {}
+    for row in conn.execute('SELECT id, class_id, name, code FROM subjects'):
+        for key in (row['code'].lower(), row['name'].lower(), str(row['id'])):
+            lookup.setdefault((row['class_id'], key), row['id'])
+    return lookup
+
+
+def import_teachers(conn, rows, hash_fn, chunk_size=500, default_class_id=None):
+    """Create teacher accounts and subject assignments; returns {'created', 'assigned', 'errors'}.
+
+    Rows need name, email, class and subjects (codes, names or ids; a list in
+    JSON or separated by ';' in CSV). Several rows may name the same teacher.
+    Existing teachers get the new assignments; a password is only required
+    for new accounts.
+    """
+    errors = []
+    classes = _class_lookup(conn)
+    subjects = _subject_lookup(conn)
+    teachers = {}
+
+    for number, row in enumerate(rows, 1):
+        name = str(row.get('name') or '').strip()
+        email = str(row.get('email') or '').strip()
+        class_id = _resolve_class(classes, row, default_class_id)
+        wanted = row.get('subjects') or row.get('subject') or []
+        if isinstance(wanted, (str, int)):
+            wanted = [part for part in str(wanted).split(';') if part.strip()]
+
+        if not name or not email:
+            errors.append({'row': number, 'email': email, 'message': 'Name and email required'})
+            continue
+        if class_id is None:
+            errors.append({'row': number, 'email': email, 'message': 'Unknown class'})
+            continue
+        subject_ids = [subjects.get((class_id, str(subject).strip().lower())) for subject in wanted]
+        if None in subject_ids:
+            unknown = [str(s) for s, i in zip(wanted, subject_ids) if i is None]
+            errors.append({'row': number, 'email': email,
+                           'message': f"Unknown subject: {', '.join(unknown)}"})
+            continue
+
+        teacher = teachers.setdefault(email, {'rows': [], 'name': name, 'email': email,
+                                              'password': '', 'assignments': []})
+        teacher['rows'].append(number)
+        teacher['password'] = teacher['password'] or str(row.get('password') or '')
+        teacher['assignments'].extend((subject_id, class_id) for subject_id in subject_ids)
+
+    existing = _existing_users(conn, teachers)
+    new_teachers = []
+    for teacher in list(teachers.values()):
+        role = existing.get(teacher['email'])
+        if role is not None and role != 'teacher':
+            message = 'Email is registered to a non-teacher account'
+        elif role is None and not teacher['password']:
+            message = 'Password required for new teacher'
+        else:
+            teacher['new'] = role is None
+            if teacher['new']:
+                new_teachers.append(teacher)
+            continue
+        errors.extend({'row': number, 'email': teacher['email'], 'message': message}
+                      for number in teacher['rows'])
+        del teachers[teacher['email']]
+
+    for teacher, hashed in zip(new_teachers, hash_fn([t['password'] for t in new_teachers])):
+        teacher['password'] = hashed
+
+    assigned = 0
+
+    def insert_many(items):
+        nonlocal assigned
+        new = [item for item in items if item['new']]
+        conn.executemany(
+            "INSERT INTO users (email, password, name, role) VALUES (?, ?, ?, 'teacher')",
+            [(item['email'], item['password'], item['name']) for item in new]
+        )
+        conn.executemany(
+            'INSERT INTO teachers (user_id) SELECT id FROM users WHERE email = ?',
+            [(item['email'],) for item in new]
+        )
+        # Skip assignments the teacher already has, as the single-teacher form does.
+        # This runs last, so once it has counted its rows they will be committed
+        cursor = conn.executemany('''
+            INSERT INTO teacher_subjects (teacher_id, subject_id, class_id)
+            SELECT t.id, ?, ? FROM teachers t JOIN users u ON t.user_id = u.id
+            WHERE u.email = ? AND NOT EXISTS (
+                SELECT 1 FROM teacher_subjects ts
+                WHERE ts.teacher_id = t.id AND ts.subject_id = ? AND ts.class_id = ?
+            )
+        ''', [(subject_id, class_id, item['email'], subject_id, class_id)
+              for item in items
+              for subject_id, class_id in dict.fromkeys(item['assignments'])])
+        assigned += max(cursor.rowcount, 0)
+
+    def insert_one(item):
+        insert_many([item])
+
+    created = 0
+    for chunk in _chunks(list(teachers.values()), chunk_size):
+        inserted = _insert_chunk(conn, chunk, insert_many, insert_one, errors)
+        created += sum(1 for item in inserted if item['new'])
+
+    errors.sort(key=lambda error: error['row'])
+    return {'created': created, 'assigned': assigned, 'errors': errors}
@@ -0,0 +1,159 @@
+"""
+Smart Attendance System - Group-Commit Writer
+One thread per process applies queued database writes, many per transaction
+
+SQLite admits one writer at a time, so a burst of requests each committing
+its own row spend their time waiting for the lock. Here request threads
+submit write operations; the writer runs everything queued (up to
+max_batch operations, collected for at most max_delay seconds) in one
+transaction and one commit, and each caller gets its own result.
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+class WriteTimeoutError(Exception):
+    """Raised when a write is not committed within the writer's timeout"""
+
+
+class GroupCommitWriter:
+    """Runs ``fn(conn, *args)`` write operations on a dedicated connection.
+
+    Each operation runs in its own savepoint: one that raises is rolled back
+    alone and its caller gets the exception, while the rest of the batch
+    commits. Futures are resolved only after COMMIT, so a caller never acts
+    on a write that could still be lost. Operations must not commit.
+    ``on_batch(size, seconds)`` is called after every transaction.
+    run() gives up after ``timeout`` seconds, so a stuck writer cannot hold
+    request threads forever; a writer thread that dies is started again on
+    the next write.
+    """
+
+    def __init__(self, connect, max_batch=64, max_delay=0.002, on_batch=None, timeout=15):
+        self.connect = connect
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.on_batch = on_batch
+        self.timeout = timeout
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None and self._pid == os.getpid() else 0
+
+    def submit(self, fn, *args):
+        """Queue a write; returns a Future of its result"""
+        future = Future()
+        self._get_queue().put((future, fn, args))
+        return future
+
+    def run(self, fn, *args):
+        """Apply a write and wait for its commit; returns its result or raises its error.
+
+        Raises WriteTimeoutError after ``timeout`` seconds; a write that had
+        already started may still be committed.
+        """
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise WriteTimeoutError('The database is busy, please retry shortly') from None
+
+    def _get_queue(self):
+        # Threads do not survive fork: a forked worker starts its own writer
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._queue = queue.SimpleQueue()
+                    self._thread = None
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, args=(self._queue,),
+                                                    name='db-writer', daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+        return self._queue
+
+    def _run(self, pending):
+        conn = None
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            try:
+                if conn is None:
+                    conn = self.connect()
+                self._apply(conn, batch)
+            except Exception as e:
+                # e.g. the database could not be opened: fail this batch and
+                # reconnect for the next one
+                logger.exception('Database writer error')
+                self._fail(batch, e)
+                if conn is not None:
+                    conn.close()
+                    conn = None
+            except BaseException:
+                # The thread is going away; the next submit() starts another.
+                # Do not leave the write lock held by an abandoned connection
+                if conn is not None:
+                    conn.rollback()
+                    conn.close()
+                self._fail(batch, RuntimeError('Database writer stopped'))
+                raise
+
+    def _apply(self, conn, batch):
+        start = time.perf_counter()
+        outcomes = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for future, fn, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    outcomes.append(None)
+                    continue
+                conn.execute('SAVEPOINT write_op')
+                try:
+                    outcomes.append((True, fn(conn, *args)))
+                except Exception as e:
+                    conn.execute('ROLLBACK TO write_op')
+                    outcomes.append((False, e))
+                conn.execute('RELEASE write_op')
+            conn.commit()
+        except Exception as e:
+            # BEGIN or COMMIT failed (e.g. the lock stayed busy): nothing was written
+            if conn.in_transaction:
+                conn.rollback()
+            self._fail(batch, e)
+            return
+
+        for (future, _fn, _args), outcome in zip(batch, outcomes):
+            if outcome is None:
+                continue
+            ok, value = outcome
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        if self.on_batch:
+            self.on_batch(len(batch), time.perf_counter() - start)
+
+    @staticmethod
+    def _fail(batch, error):
+        for future, _fn, _args in batch:
+            if future.done():
+                continue
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
@@ -0,0 +1,220 @@
+"""
+Smart Attendance System - Shared Encoding Store
+Memory-mapped files holding every registered face encoding, shared by all worker processes
+
+The store is a directory with one file per class, each rewritten as a whole
+and swapped in with os.replace so a reader never sees a partial file:
+    class-<id>.bin: header | student ids (int64 x N) | squared norms (float32 x N)
+                           | matrix (float32 x N x dims)
+Rows are sorted by student id and a class's ClassEncodings is a set of views
+over its mapping. Every process maps the files read-only, so the kernel
+holds a single copy in the page cache no matter how many workers are
+running. Registering a face rewrites only that student's class, under that
+class's file lock, so the cost does not grow with the number of classes and
+writers to different classes do not wait for each other.
+
+A small ``generation`` file counts changes to any class; it is swapped in
+the same way after every class file, and lets a process notice that another
+one changed some class.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+from face_store import ClassEncodings
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the single-process development server
+    fcntl = None
+
+STORE_MAGIC = b'FENC'
+STORE_VERSION = 2
+# magic (4s) | format version (H) | dimensions (H) | class generation (Q) | rows (Q)
+STORE_HEADER = struct.Struct('<4sHHQQ')
+GENERATION = struct.Struct('<Q')
+
+
+def _file_id(stat):
+    return stat.st_dev, stat.st_ino
+
+
+class _Mapping:
+    """One generation of a class file mapped read-only"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.file_id = _file_id(os.fstat(f.fileno()))
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, dims, self.generation, rows = STORE_HEADER.unpack_from(buffer)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError('Unsupported encoding store format')
+        self.dims = dims
+
+        offset = STORE_HEADER.size
+        arrays = []
+        for dtype, count in (('<i8', rows), ('<f4', rows), ('<f4', rows * dims)):
+            arrays.append(np.frombuffer(buffer, dtype=dtype, count=count, offset=offset))
+            offset += arrays[-1].nbytes
+        student_ids, sq_norms, matrix = arrays
+        # ClassEncodings as views over the mapping (empty if none registered)
+        self.encodings = ClassEncodings(student_ids, matrix.reshape(rows, dims), sq_norms)
+
+
+class SharedEncodingStore:
+    """Per-class encoding matrices read from files shared between processes.
+
+    ``loader(class_ids)`` returns (class_id, student_id, face_encoding) rows
+    ordered by class and student id, for the given classes or for every class
+    when ``class_ids`` is None. Any process may write: invalidate() reloads
+    the changed classes, each under its own exclusive file lock, and bumps
+    the store's generation. Readers spot a new class file with one stat()
+    per lookup and remap it; when the generation moves they call
+    ``on_change(generation)``.
+    """
+
+    def __init__(self, path, loader, on_change=None):
+        self.path = path
+        self.loader = loader
+        self.on_change = on_change
+        self._mappings = {}
+        self._generation = None
+        self._lock = threading.Lock()
+        self._file_locks = {}
+
+    @property
+    def generation(self):
+        self._check_generation()
+        return self._generation[1] if self._generation is not None else 0
+
+    def get(self, class_id):
+        """Return the ClassEncodings for a class"""
+        class_id = int(class_id)
+        path = self._class_path(class_id)
+        try:
+            file_id = _file_id(os.stat(path))
+        except FileNotFoundError:
+            # Not loaded since the store was created: load it on first use
+            self._write([class_id], missing_only=True)
+            file_id = _file_id(os.stat(path))
+
+        mapping = self._mappings.get(class_id)
+        if mapping is None or mapping.file_id != file_id:
+            with self._lock:
+                mapping = self._mappings.get(class_id)
+                if mapping is None or mapping.file_id != file_id:
+                    # Views handed out earlier keep the old mapping alive until released
+                    mapping = self._mappings[class_id] = _Mapping(path)
+        self._check_generation()
+        return mapping.encodings
+
+    def invalidate(self, *class_ids):
+        """Reload these classes from the loader, after their rows were committed"""
+        class_ids = sorted({int(class_id) for class_id in class_ids if class_id is not None})
+        if class_ids:
+            self._write(class_ids)
+
+    def rebuild(self):
+        """Reload every stored class, e.g. at startup in case the database changed offline.
+
+        Classes without a file yet are loaded on first use.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        self._write(sorted(int(name[len('class-'):-len('.bin')]) for name in os.listdir(self.path)
+                           if name.startswith('class-') and name.endswith('.bin')))
+
+    def _class_path(self, class_id):
+        return os.path.join(self.path, f'class-{class_id}.bin')
+
+    def _check_generation(self):
+        path = os.path.join(self.path, 'generation')
+        previous = self._generation
+        try:
+            file_id = _file_id(os.stat(path))
+        except FileNotFoundError:
+            if previous is None:
+                self._generation = (None, 0, None)
+            return
+        if previous is not None and previous[0] == file_id:
+            return
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        # Kept open so that its inode cannot be reused by a later generation
+        (generation,) = GENERATION.unpack(f.read(GENERATION.size))
+        self._generation = (_file_id(os.fstat(f.fileno())), generation, f)
+        if previous is not None:
+            if previous[2] is not None:
+                previous[2].close()
+            if previous[1] != generation and self.on_change:
+                self.on_change(generation)
+
+    def _write(self, class_ids, missing_only=False):
+        os.makedirs(self.path, exist_ok=True)
+        written = False
+        for class_id in class_ids:
+            # Load under the lock so a slower writer never overwrites newer rows
+            with self._locked(f'class-{class_id}.lock'):
+                if missing_only and os.path.exists(self._class_path(class_id)):
+                    continue
+                self._write_class(class_id, [(student_id, blob) for _class_id, student_id, blob
+                                             in self.loader([class_id])])
+                written = True
+        # First loads change nothing another process could have cached
+        if not written or missing_only:
+            return
+        with self._locked('generation.lock'):
+            path = os.path.join(self.path, 'generation')
+            try:
+                with open(path, 'rb') as f:
+                    (generation,) = GENERATION.unpack(f.read(GENERATION.size))
+            except (FileNotFoundError, struct.error):
+                generation = 0
+            self._replace(path, [GENERATION.pack(generation + 1)])
+
+    def _write_class(self, class_id, class_rows):
+        path = self._class_path(class_id)
+        try:
+            with open(path, 'rb') as f:
+                _magic, _version, dims, generation, _rows = STORE_HEADER.unpack(f.read(STORE_HEADER.size))
+        except (FileNotFoundError, struct.error):
+            dims, generation = 128, 0
+        entry = ClassEncodings.from_rows(class_rows)
+        if len(entry.student_ids):
+            dims = entry.matrix.shape[1]
+        generation += 1
+        self._replace(path, [
+            STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, dims, generation, len(entry.student_ids)),
+            np.ascontiguousarray(entry.student_ids, dtype='<i8').tobytes(),
+            np.ascontiguousarray(entry.sq_norms, dtype='<f4').tobytes(),
+            np.ascontiguousarray(entry.matrix, dtype='<f4').tobytes(),
+        ])
+
+    def _replace(self, path, chunks):
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=os.path.basename(path) + '.',
+                                         suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    @contextmanager
+    def _locked(self, name):
+        # flock serialises processes; threads in this process also take a
+        # per-file lock, which is all there is on Windows
+        with self._lock:
+            thread_lock = self._file_locks.setdefault(name, threading.Lock())
+        with thread_lock, open(os.path.join(self.path, name), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
@@ -0,0 +1,285 @@
+"""
+Smart Attendance System - Bulk Face Enrollment
+Resumable jobs that encode a zip archive or directory of student photos in a process pool
+
+Photos are named after the student's email or student id (``jane@x.edu.jpg``,
+``42.png``). Results are written in batches; each batch is a checkpoint, so
+a job that stops part-way resumes with the photos that were not yet written.
+"""
+
+import os
+import time
+import zipfile
+from collections import deque
+from face_engine import FaceValidationError, encode_single_face
+from face_store import encode_face
+from worker_pool import PoolBusyError, JobTimeoutError
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+class EnrollmentSource:
+    """Read access to the photos in a zip archive or a directory tree"""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = zipfile.ZipFile(path) if os.path.isfile(path) and zipfile.is_zipfile(path) else None
+        if self._zip is None and not os.path.isdir(path):
+            raise ValueError('Source must be a zip archive or a directory')
+
+    def names(self):
+        if self._zip is not None:
+            names = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            names = [os.path.relpath(os.path.join(root, filename), self.path)
+                     for root, _dirs, files in os.walk(self.path) for filename in files]
+        # Skip hidden files such as macOS '._name.jpg' resource forks
+        return sorted(name for name in names
+                      if name.lower().endswith(IMAGE_EXTENSIONS)
+                      and not os.path.basename(name).startswith('.'))
+
+    def read(self, name, max_bytes):
+        if self._zip is not None:
+            size = self._zip.getinfo(name).file_size
+        else:
+            name = os.path.join(self.path, name)
+            size = os.path.getsize(name)
+        if size > max_bytes:
+            raise FaceValidationError('Image is too large')
+        if self._zip is not None:
+            return self._zip.read(name)
+        with open(name, 'rb') as f:
+            return f.read()
+
+    def close(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def student_key(name):
+    """The email or student id a photo is named after"""
+    return os.path.splitext(os.path.basename(name))[0].strip()
+
+
+# ============================================
+# JOBS
+# ============================================
+
+def create_job(conn, source_path):
+    """Register a job and one item per photo; returns the job id.
+
+    Photos that match no student, and extra photos of the same student, are
+    recorded as skipped straight away.
+    """
+    source = EnrollmentSource(source_path)
+    try:
+        names = source.names()
+    finally:
+        source.close()
+
+    students = {}
+    for row in conn.execute('SELECT s.id, u.email FROM students s JOIN users u ON s.user_id = u.id'):
+        students[row['email'].lower()] = row['id']
+        students[str(row['id'])] = row['id']
+
+    cursor = conn.execute('INSERT INTO enrollment_jobs (source, total) VALUES (?, ?)',
+                          (source_path, len(names)))
+    job_id = cursor.lastrowid
+
+    items, seen, skipped = [], set(), 0
+    for name in names:
+        student_id = students.get(student_key(name).lower())
+        if student_id is None:
+            status, message = 'skipped', 'No student matches this file name'
+        elif student_id in seen:
+            status, message = 'skipped', 'Another photo of this student is already in the job'
+        else:
+            status, message = 'pending', None
+            seen.add(student_id)
+        skipped += status == 'skipped'
+        items.append((job_id, name, student_id, status, message))
+
+    conn.executemany('''
+        INSERT INTO enrollment_items (job_id, name, student_id, status, message)
+        VALUES (?, ?, ?, ?, ?)
+    ''', items)
+    conn.execute('UPDATE enrollment_jobs SET skipped = ? WHERE id = ?', (skipped, job_id))
+    conn.commit()
+    return job_id
+
+
+def claim_job(conn, job_id, stale_after):
+    """Mark a job as running unless another runner holds it; returns True if claimed.
+
+    A running job whose heartbeat is older than ``stale_after`` seconds is
+    presumed dead (its process stopped) and can be claimed again.
+    """
+    now = time.time()
+    cursor = conn.execute('''
+        UPDATE enrollment_jobs SET status = 'running', heartbeat_at = ?, error = NULL
+        WHERE id = ? AND (status IN ('pending', 'failed')
+                          OR (status = 'running' AND heartbeat_at < ?))
+    ''', (now, job_id, now - stale_after))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+def job_status(conn, job_id, stale_after, failures=50):
+    """Progress and throughput of a job, or None if it does not exist"""
+    job = conn.execute('SELECT * FROM enrollment_jobs WHERE id = ?', (job_id,)).fetchone()
+    if job is None:
+        return None
+
+    status = job['status']
+    if status == 'running' and job['heartbeat_at'] < time.time() - stale_after:
+        status = 'stalled'
+    seconds = job['processing_seconds']
+    rate = job['processed'] / seconds if seconds else 0.0
+    pending = job['total'] - job['skipped'] - job['processed']
+
+    return {
+        'id': job['id'],
+        'status': status,
+        'total': job['total'],
+        'processed': job['processed'],
+        'enrolled': job['enrolled'],
+        'failed': job['failed'],
+        'skipped': job['skipped'],
+        'pending': pending,
+        'images_per_second': round(rate, 2),
+        'processing_seconds': round(seconds, 2),
+        'eta_seconds': round(pending / rate, 1) if rate else None,
+        'error': job['error'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+        'failures': [dict(row) for row in conn.execute('''
+            SELECT name, status, message FROM enrollment_items
+            WHERE job_id = ? AND status IN ('failed', 'skipped')
+            ORDER BY id LIMIT ?
+        ''', (job_id, failures))]
+    }
+
+
+# ============================================
+# RUNNER
+# ============================================
+
+class EnrollmentRunner:
+    """Processes the pending items of a claimed job.
+
+    Photos are read in the calling thread and encoded in ``pool``; up to
+    max_workers + max_queue photos are in flight so reading overlaps with
+    encoding. Results are written every ``batch_size`` photos or
+    ``checkpoint_seconds``, whichever comes first, and
+    ``on_enrolled(conn, student_ids)`` is called after each written batch.
+    """
+
+    def __init__(self, connect, pool, options=None, dtype='float32', batch_size=50,
+                 checkpoint_seconds=5, max_image_bytes=10 * 1024 * 1024, on_enrolled=None):
+        self.connect = connect
+        self.pool = pool
+        self.options = options
+        self.dtype = dtype
+        self.batch_size = batch_size
+        self.checkpoint_seconds = checkpoint_seconds
+        self.max_image_bytes = max_image_bytes
+        self.on_enrolled = on_enrolled
+
+    def run(self, job_id):
+        conn = self.connect()
+        try:
+            self._run(conn, job_id)
+        except Exception as e:
+            conn.rollback()
+            conn.execute("UPDATE enrollment_jobs SET status = 'failed', error = ? WHERE id = ?",
+                         (str(e), job_id))
+            conn.commit()
+            raise
+        finally:
+            conn.close()
+
+    def _run(self, conn, job_id):
+        source_path = conn.execute('SELECT source FROM enrollment_jobs WHERE id = ?',
+                                   (job_id,)).fetchone()['source']
+        pending = conn.execute('''
+            SELECT id, name, student_id FROM enrollment_items
+            WHERE job_id = ? AND status = 'pending'
+            ORDER BY id
+        ''', (job_id,)).fetchall()
+
+        source = EnrollmentSource(source_path)
+        window = max(self.pool.max_workers + self.pool.max_queue, 1)
+        in_flight = deque()
+        results = []
+        self._last_checkpoint = time.monotonic()
+
+        def collect():
+            item, future = in_flight.popleft()
+            try:
+                encoding = self.pool.result(future)['encoding']
+                results.append((item, 'enrolled', None, encode_face(encoding, self.dtype)))
+            except (FaceValidationError, JobTimeoutError) as e:
+                results.append((item, 'failed', str(e), None))
+
+        try:
+            for item in pending:
+                try:
+                    image = source.read(item['name'], self.max_image_bytes)
+                except (FaceValidationError, OSError, KeyError, zipfile.BadZipFile) as e:
+                    results.append((item, 'failed', str(e), None))
+                else:
+                    while True:
+                        if len(in_flight) < window:
+                            try:
+                                in_flight.append((item, self.pool.submit(
+                                    encode_single_face, image, self.options)))
+                                break
+                            except PoolBusyError as e:
+                                # Another job holds the pool; wait instead of failing
+                                if not in_flight:
+                                    time.sleep(e.retry_after)
+                                    continue
+                        collect()
+                self._maybe_checkpoint(conn, job_id, results)
+
+            while in_flight:
+                collect()
+                self._maybe_checkpoint(conn, job_id, results)
+        finally:
+            source.close()
+
+        self._checkpoint(conn, job_id, results)
+        conn.execute('''
+            UPDATE enrollment_jobs SET status = 'completed', finished_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (job_id,))
+        conn.commit()
+
+    def _maybe_checkpoint(self, conn, job_id, results):
+        if (len(results) >= self.batch_size or
+                time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds):
+            self._checkpoint(conn, job_id, results)
+
+    def _checkpoint(self, conn, job_id, results):
+        """Write a batch of results and the job's progress in one transaction"""
+        now = time.monotonic()
+        elapsed = now - self._last_checkpoint
+        self._last_checkpoint = now
+
+        enrolled = [(blob, item['student_id']) for item, status, _message, blob in results
+                    if status == 'enrolled']
+        conn.executemany('UPDATE students SET face_encoding = ?, face_registered = 1 WHERE id = ?',
+                         enrolled)
+        conn.executemany('UPDATE enrollment_items SET status = ?, message = ? WHERE id = ?',
+                         [(status, message, item['id']) for item, status, message, _blob in results])
+        conn.execute('''
+            UPDATE enrollment_jobs
+            SET processed = processed + ?, enrolled = enrolled + ?, failed = failed + ?,
+                processing_seconds = processing_seconds + ?, heartbeat_at = ?
+            WHERE id = ?
+        ''', (len(results), len(enrolled), len(results) - len(enrolled), elapsed, time.time(), job_id))
+        conn.commit()
+        results.clear()
+
+        if enrolled and self.on_enrolled:
+            self.on_enrolled(conn, [student_id for _blob, student_id in enrolled])
@@ -0,0 +1,180 @@
+"""
+Smart Attendance System - Face Engine
+Face detection and encoding jobs executed in the face-processing pool
+
+OpenCV and face_recognition (dlib and its models) are imported on first use,
+so processes that never run a face job (the web process, CLI commands,
+admin-only workers) do not pay for them.
+"""
+
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+# Modules loaded by load_face_stack(); a fork server can preload them so its
+# pool workers share one copy
+FACE_STACK_MODULES = ('cv2', 'face_recognition')
+
+cv2 = None
+face_recognition = None
+_stack_lock = threading.Lock()
+
+# Detector settings used when the caller does not pass any options.
+#   max_dimension: images are downscaled so their longest side is at most
+#                  this many pixels before detection (0 disables it)
+#   model:         'hog' (CPU friendly) or 'cnn' (more accurate, much slower)
+#   upsample:      number_of_times_to_upsample passed to face_locations
+#   jitters:       num_jitters passed to face_encodings
+#   backend:       'face_recognition', or 'stub' for benchmarks: no detection,
+#                  the encoding is derived from the image bytes so identical
+#                  uploads match and different ones do not
+DEFAULT_OPTIONS = {
+    'max_dimension': 640,
+    'model': 'hog',
+    'upsample': 1,
+    'jitters': 1,
+    'backend': 'face_recognition',
+}
+
+
+class FaceValidationError(Exception):
+    """Raised when an image cannot be used (no face, several faces, bad data)"""
+
+
+def load_face_stack():
+    """Import OpenCV and face_recognition once per process"""
+    global cv2, face_recognition
+    if face_recognition is None:
+        with _stack_lock:
+            if face_recognition is None:
+                import cv2 as cv2_module
+                import face_recognition as face_recognition_module
+                cv2 = cv2_module
+                face_recognition = face_recognition_module
+
+
+def warm_up(backend='face_recognition'):
+    """Load the face stack and run one detection so the first real job is fast"""
+    if backend == 'stub':
+        return
+    load_face_stack()
+    face_recognition.face_locations(np.zeros((32, 32, 3), np.uint8))
+
+
+@contextmanager
+def _stage(timings, name):
+    """Record the wall time of a processing stage in milliseconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+def decode_image(image_bytes):
+    """Decode JPEG/PNG bytes into an RGB image"""
+    load_face_stack()
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    if image is None:
+        raise FaceValidationError('Failed to decode image')
+    # Swap channels in place rather than allocating a second full-size image
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+def detect_faces(rgb_image, options, timings):
+    """Run detection on a downscaled copy and map boxes back to full resolution"""
+    load_face_stack()
+    height, width = rgb_image.shape[:2]
+    longest = max(height, width)
+    max_dimension = options['max_dimension']
+
+    with _stage(timings, 'resize'):
+        if max_dimension and longest > max_dimension:
+            scale = max_dimension / longest
+            small = cv2.resize(rgb_image, (round(width * scale), round(height * scale)),
+                               interpolation=cv2.INTER_AREA)
+        else:
+            scale = 1.0
+            small = rgb_image
+
+    with _stage(timings, 'detect'):
+        locations = face_recognition.face_locations(
+            small,
+            number_of_times_to_upsample=options['upsample'],
+            model=options['model']
+        )
+
+    if scale == 1.0:
+        return locations
+
+    return [
+        (max(0, round(top / scale)), min(width, round(right / scale)),
+         min(height, round(bottom / scale)), max(0, round(left / scale)))
+        for top, right, bottom, left in locations
+    ]
+
+
+def stub_encoding(image_bytes):
+    """Deterministic 128-d pseudo-encoding of the image bytes (stub backend)"""
+    if not image_bytes:
+        raise FaceValidationError('Failed to decode image')
+    seed = int.from_bytes(hashlib.sha256(image_bytes).digest()[:8], 'little')
+    return np.random.default_rng(seed).random(128)
+
+
+def encode_single_face(image_bytes, options=None):
+    """Detect exactly one face in the image and return its 128-d encoding"""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    timings = {}
+
+    if options['backend'] == 'stub':
+        with _stage(timings, 'encode'):
+            encoding = stub_encoding(image_bytes)
+        return {'encoding': encoding, 'timings': timings}
+
+    with _stage(timings, 'decode'):
+        rgb_image = decode_image(image_bytes)
+
+    face_locations = detect_faces(rgb_image, options, timings)
+
+    if len(face_locations) == 0:
+        raise FaceValidationError('No face detected')
+
+    if len(face_locations) > 1:
+        raise FaceValidationError('Multiple faces detected. Please ensure only one face is visible')
+
+    with _stage(timings, 'encode'):
+        face_encodings = face_recognition.face_encodings(
+            rgb_image, face_locations, num_jitters=options['jitters'])
+    return {'encoding': face_encodings[0], 'timings': timings}
+
+
+def encode_all_faces(image_bytes, options=None):
+    """Detect every face in a group photo and return their locations and encodings"""
+    options = dict(DEFAULT_OPTIONS, **(options or {}))
+    timings = {}
+
+    if options['backend'] == 'stub':
+        # The whole photo stands for one face
+        with _stage(timings, 'encode'):
+            encoding = stub_encoding(image_bytes)
+        return {'faces': [{'location': (0, 0, 0, 0), 'encoding': encoding}], 'timings': timings}
+
+    with _stage(timings, 'decode'):
+        rgb_image = decode_image(image_bytes)
+
+    face_locations = detect_faces(rgb_image, options, timings)
+
+    with _stage(timings, 'encode'):
+        face_encodings = face_recognition.face_encodings(
+            rgb_image, face_locations, num_jitters=options['jitters'])
+    return {
+        'faces': [
+            {'location': tuple(int(v) for v in location), 'encoding': encoding}
+            for location, encoding in zip(face_locations, face_encodings)
+        ],
+        'timings': timings
+    }
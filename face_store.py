@@ -0,0 +1,160 @@
+"""
+Smart Attendance System - Face Encoding Storage
+Compact binary format for the 128-d face encodings kept in students.face_encoding
+"""
+
+import struct
+import numpy as np
+
+# Blob layout: 8-byte header followed by the raw little-endian vector.
+#   magic (2s) | format version (B) | dtype code (B) | dimensions (H) | padding
+# The header is 8 bytes so the payload stays aligned for float32 and float64.
+ENCODING_MAGIC = b'FE'
+ENCODING_VERSION = 1
+HEADER = struct.Struct('<2sBBH2x')
+
+DTYPE_CODES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f8'),
+}
+DTYPE_NAMES = {
+    'float32': 1,
+    'float64': 2,
+}
+
+
+def encode_face(encoding, dtype='float32'):
+    """Serialize a face encoding into a versioned binary blob"""
+    code = DTYPE_NAMES[dtype]
+    vector = np.asarray(encoding, dtype=DTYPE_CODES[code])
+    return HEADER.pack(ENCODING_MAGIC, ENCODING_VERSION, code, vector.size) + vector.tobytes()
+
+
+def decode_face(blob):
+    """Return a face encoding as a read-only NumPy view over the stored blob.
+
+    Legacy comma-separated text values are still accepted so rows that have
+    not been migrated yet keep working.
+    """
+    if isinstance(blob, str):
+        return np.array([float(x) for x in blob.split(',')])
+
+    magic, version, code, dims = HEADER.unpack_from(blob)
+    if magic != ENCODING_MAGIC or version != ENCODING_VERSION or code not in DTYPE_CODES:
+        raise ValueError('Unsupported face encoding format')
+    return np.frombuffer(blob, dtype=DTYPE_CODES[code], count=dims, offset=HEADER.size)
+
+
+def migrate_text_encodings(conn, dtype='float32'):
+    """Convert comma-separated TEXT encodings to binary blobs in place"""
+    rows = conn.execute(
+        "SELECT id, face_encoding FROM students WHERE typeof(face_encoding) = 'text' AND face_encoding != ''"
+    ).fetchall()
+    conn.executemany(
+        'UPDATE students SET face_encoding = ? WHERE id = ?',
+        [(encode_face(decode_face(row[1]), dtype), row[0]) for row in rows]
+    )
+    return len(rows)
+
+
+class ClassEncodings:
+    """All registered encodings of one class as a contiguous N x 128 matrix.
+
+    The arrays may be read-only views, e.g. over the shared encoding store.
+    """
+
+    def __init__(self, student_ids, matrix, sq_norms=None):
+        self.student_ids = np.asarray(student_ids, dtype=np.int64)
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.index = {student_id: row for row, student_id in enumerate(self.student_ids.tolist())}
+        if sq_norms is None:
+            sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+        self.sq_norms = np.asarray(sq_norms, dtype=np.float32)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build the matrix from (student_id, face_encoding blob) rows"""
+        rows = [(student_id, decode_face(blob)) for student_id, blob in rows]
+        dims = rows[0][1].size if rows else 128
+        matrix = np.empty((len(rows), dims), dtype=np.float32)
+        for i, (_, vector) in enumerate(rows):
+            matrix[i] = vector
+        return cls([student_id for student_id, _ in rows], matrix)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.student_ids.nbytes + self.sq_norms.nbytes
+
+    def row(self, student_id):
+        """Return the stored encoding of a student, or None if not registered"""
+        row = self.index.get(student_id)
+        return None if row is None else self.matrix[row]
+
+    def distance_to(self, student_id, encoding):
+        """Euclidean distance between an encoding and one student's stored encoding"""
+        stored = self.row(student_id)
+        if stored is None:
+            return None
+        return float(np.linalg.norm(stored - np.asarray(encoding, dtype=np.float32)))
+
+    def distances(self, encodings):
+        """Distance matrix (F x N) between F probe encodings and every student.
+
+        Uses ||a - b||^2 = ||a||^2 + ||b||^2 - 2ab so a whole batch of probes
+        is matched against the class with a single matrix multiplication.
+        """
+        probes = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        if len(self) == 0:
+            return np.empty((probes.shape[0], 0), dtype=np.float32)
+        sq = np.einsum('ij,ij->i', probes, probes)[:, None] + self.sq_norms[None, :]
+        sq -= 2.0 * (probes @ self.matrix.T)
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq, out=sq)
+
+
+def match_group(class_encodings, encodings, tolerance, margin):
+    """Assign each probe face to at most one student of the class.
+
+    All probes are compared with the class in a single distance computation.
+    A face is ambiguous when its two best candidates are within ``margin`` of
+    each other, or when a closer face already claimed the same student.
+    Returns one dict per probe with a 'status' of matched/unmatched/ambiguous.
+    """
+    if len(encodings) == 0:
+        return []
+
+    distances = class_encodings.distances(encodings)
+    results = []
+    claims = {}
+
+    for face, row in enumerate(distances):
+        order = np.argsort(row)
+        candidates = [
+            (int(class_encodings.student_ids[i]), float(row[i]))
+            for i in order if row[i] <= tolerance
+        ]
+        if not candidates:
+            results.append({'status': 'unmatched', 'candidates': []})
+            continue
+
+        if len(candidates) > 1 and candidates[1][1] - candidates[0][1] < margin:
+            results.append({'status': 'ambiguous', 'reason': 'similar_candidates', 'candidates': candidates[:3]})
+            continue
+
+        student_id, distance = candidates[0]
+        results.append({'status': 'matched', 'student_id': student_id, 'distance': distance,
+                        'candidates': candidates[:3]})
+        claims.setdefault(student_id, []).append(face)
+
+    # A student can only be present once: keep the closest face for each claim
+    for student_id, faces in claims.items():
+        if len(faces) < 2:
+            continue
+        faces.sort(key=lambda f: results[f]['distance'])
+        for face in faces[1:]:
+            results[face] = {'status': 'ambiguous', 'reason': 'student_matched_by_closer_face',
+                             'candidates': results[face]['candidates']}
+    return results
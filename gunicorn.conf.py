@@ -0,0 +1,39 @@
+"""
+Smart Attendance System - Gunicorn Settings
+Read automatically by gunicorn from the working directory
+
+With --preload (as in the Procfile) the master imports the app, initialises
+the database and rebuilds the shared encoding store once; workers are forked
+from it and share that memory copy-on-write. Each worker then starts
+its face pool before serving, so no request waits for models to load.
+With the default forkserver start method every worker's fork server
+imports the face models itself, one copy per worker; set
+FACE_POOL_START_METHOD=fork to load them once in the master instead.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+# One worker per core: encodings live in the shared store, so extra workers
+# cost no extra copies of them
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 120
+
+# Every worker has its own process pools; split the cores between them unless
+# the sizes are set explicitly (read when app is imported, after this file)
+for _pool in ('FACE_POOL_WORKERS', 'PASSWORD_POOL_WORKERS', 'ENROLLMENT_POOL_WORKERS'):
+    os.environ.setdefault(_pool, str(max(1, (os.cpu_count() or 1) // workers)))
+
+
+def when_ready(server):
+    # Master process; the app module is already imported when preloading
+    if server.cfg.preload_app:
+        import app
+        app.warm_up(start_pools=False)
+
+
+def post_fork(server, worker):
+    # Worker process, before its request threads exist (safe to fork pools)
+    import app
+    app.warm_up()
@@ -0,0 +1,85 @@
+"""
+Smart Attendance System - Identity Caches
+Verified-token and per-user identity caches used by token_required
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class TokenCache:
+    """LRU of verified JWTs and their claims, valid until each token's expiry.
+
+    A hit means the exact token string was verified before, so the HMAC
+    check is skipped for repeated requests with the same token.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._claims = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            claims = self._claims.get(token)
+            if claims is None:
+                return None
+            if claims.get('exp', float('inf')) <= time.time():
+                del self._claims[token]
+                return None
+            self._claims.move_to_end(token)
+            return claims
+
+    def put(self, token, claims):
+        with self._lock:
+            self._claims[token] = claims
+            self._claims.move_to_end(token)
+            while len(self._claims) > self.max_size:
+                self._claims.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._claims.clear()
+
+
+class IdentityCache:
+    """Resolved identities (role, name, teacher/student ids, class) by user id.
+
+    ``loader(user_id)`` returns the identity dict or None for a deleted user.
+    Entries live for ``ttl`` seconds so changes made by other processes are
+    picked up; changes made here should call invalidate() straight away.
+    """
+
+    def __init__(self, loader, ttl=60, max_size=10000):
+        self.loader = loader
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                return entry[1]
+
+        identity = self.loader(user_id)
+        if identity is not None:
+            with self._lock:
+                self._entries[user_id] = (now + self.ttl, identity)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return identity
+
+    def invalidate(self, *user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
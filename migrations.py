@@ -0,0 +1,313 @@
+"""
+Smart Attendance System - Schema Migrations
+Ordered, versioned schema changes applied on top of the tables created by init_db
+"""
+
+from face_store import migrate_text_encodings
+from summaries import COUNTED_TABLES, rebuild_summaries, rebuild_entity_counts
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function; versions must be unique and increasing"""
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return f
+    return decorator
+
+
+def current_version(conn):
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn, settings):
+    """Apply every pending migration, each in its own transaction.
+
+    BEGIN IMMEDIATE takes the write lock before the version is re-read, so
+    several workers booting at once apply each migration exactly once.
+    Returns the list of versions that were applied.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version <= current_version(conn):
+            continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= current_version(conn):
+                conn.rollback()
+                continue
+            apply(conn, settings)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+    return applied
+
+
+# ============================================
+# MIGRATIONS
+# ============================================
+
+@migration(1, 'Store face encodings as binary blobs')
+def binary_face_encodings(conn, settings):
+    migrate_text_encodings(conn, settings.get('FACE_ENCODING_DTYPE', 'float32'))
+
+
+@migration(2, 'Hot-path indexes and one attendance row per student and session')
+def hot_path_indexes(conn, settings):
+    # Keep the earliest mark if the old check-then-insert race left duplicates
+    conn.execute('''
+        DELETE FROM attendance WHERE id NOT IN (
+            SELECT MIN(id) FROM attendance GROUP BY session_id, student_id
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_attendance_session_student ON attendance(session_id, student_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_student ON attendance(student_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_code_active ON sessions(code, is_active)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_class_subject ON sessions(class_id, subject_id, start_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_user ON students(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_students_class ON students(class_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teachers_user ON teachers(user_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_subjects_class ON subjects(class_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teacher_subjects_teacher ON teacher_subjects(teacher_id, class_id)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_teacher_subjects_class ON teacher_subjects(class_id)')
+
+
+@migration(3, 'Session codes are unique among active sessions')
+def unique_active_session_codes(conn, settings):
+    # Older duplicates of an active code can only be stale sessions whose
+    # teacher never ended them; keep the newest one active
+    conn.execute('''
+        UPDATE sessions SET is_active = 0, end_time = COALESCE(end_time, CURRENT_TIMESTAMP)
+        WHERE is_active = 1 AND id NOT IN (
+            SELECT MAX(id) FROM sessions WHERE is_active = 1 GROUP BY code
+        )
+    ''')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_sessions_active_code ON sessions(code) WHERE is_active = 1')
+
+
+@migration(4, 'Per-student and per-class attendance counters')
+def attendance_counters(conn, settings):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS student_subject_stats (
+            student_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (student_id, subject_id),
+            FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE,
+            FOREIGN KEY (subject_id) REFERENCES subjects(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS class_subject_stats (
+            class_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            sessions_held INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (class_id, subject_id),
+            FOREIGN KEY (class_id) REFERENCES classes(id) ON DELETE CASCADE,
+            FOREIGN KEY (subject_id) REFERENCES subjects(id) ON DELETE CASCADE
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO student_subject_stats (student_id, subject_id, present_count)
+        SELECT a.student_id, s.subject_id, COUNT(*)
+        FROM attendance a
+        JOIN sessions s ON a.session_id = s.id
+        GROUP BY a.student_id, s.subject_id
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO class_subject_stats (class_id, subject_id, sessions_held)
+        SELECT class_id, subject_id, COUNT(*)
+        FROM sessions
+        GROUP BY class_id, subject_id
+    ''')
+
+
+@migration(5, 'Per-session attendance counts and last attendance per subject')
+def session_summaries(conn, settings):
+    conn.execute('ALTER TABLE student_subject_stats ADD COLUMN last_attended_at TIMESTAMP')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS session_stats (
+            session_id INTEGER PRIMARY KEY,
+            class_id INTEGER NOT NULL,
+            subject_id INTEGER NOT NULL,
+            present_count INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE
+        )
+    ''')
+    rebuild_summaries(conn)
+
+
+@migration(6, 'Trigger-maintained row counts for the admin dashboard')
+def entity_counts(conn, settings):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS entity_counts (
+            entity TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('ALTER TABLE classes ADD COLUMN student_count INTEGER NOT NULL DEFAULT 0')
+    for table in COUNTED_TABLES:
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+            BEGIN
+                UPDATE entity_counts SET count = count + 1 WHERE entity = '{table}';
+            END
+        ''')
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+            BEGIN
+                UPDATE entity_counts SET count = count - 1 WHERE entity = '{table}';
+            END
+        ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_students_class_insert AFTER INSERT ON students
+        BEGIN
+            UPDATE classes SET student_count = student_count + 1 WHERE id = NEW.class_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_students_class_delete AFTER DELETE ON students
+        BEGIN
+            UPDATE classes SET student_count = student_count - 1 WHERE id = OLD.class_id;
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_students_class_update AFTER UPDATE OF class_id ON students
+        WHEN OLD.class_id IS NOT NEW.class_id
+        BEGIN
+            UPDATE classes SET student_count = student_count - 1 WHERE id = OLD.class_id;
+            UPDATE classes SET student_count = student_count + 1 WHERE id = NEW.class_id;
+        END
+    ''')
+    rebuild_entity_counts(conn)
+
+
+@migration(7, 'Checkpoint tables for bulk face enrollment jobs')
+def enrollment_jobs(conn, settings):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS enrollment_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            total INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            enrolled INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            processing_seconds REAL NOT NULL DEFAULT 0,
+            heartbeat_at REAL,
+            error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS enrollment_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            student_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            message TEXT,
+            FOREIGN KEY (job_id) REFERENCES enrollment_jobs(id) ON DELETE CASCADE
+        )
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_enrollment_items_job_status ON enrollment_items(job_id, status)')
+
+
+@migration(8, 'Queue of attendance selfies verified in the background')
+def attendance_jobs(conn, settings):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            student_id INTEGER NOT NULL,
+            image BLOB,
+            status TEXT NOT NULL DEFAULT 'pending',
+            status_code INTEGER,
+            message TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            submitted_at REAL NOT NULL,
+            claimed_at REAL,
+            finished_at REAL,
+            FOREIGN KEY (session_id) REFERENCES sessions(id) ON DELETE CASCADE,
+            FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE
+        )
+    ''')
+    # Claiming scans pending jobs in id (arrival) order
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_jobs_status ON attendance_jobs(status, id)')
+
+
+@migration(9, 'Session expiry times and per-class/subject session durations')
+def session_expiry(conn, settings):
+    # NULL durations fall back to the subject's, then the class's, then SESSION_DURATION_SECONDS
+    conn.execute('ALTER TABLE classes ADD COLUMN session_duration INTEGER')
+    conn.execute('ALTER TABLE subjects ADD COLUMN session_duration INTEGER')
+    # Unix timestamp, like the registry's expires_at
+    conn.execute('ALTER TABLE sessions ADD COLUMN expires_at REAL')
+    conn.execute('''
+        UPDATE sessions SET expires_at = CAST(strftime('%s', start_time) AS REAL) + ?
+    ''', (settings.get('SESSION_DURATION_SECONDS', 60),))
+    # Only running sessions are indexed, so the index stays small however
+    # many finished sessions pile up
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_sessions_active_expiry ON sessions(expires_at)
+        WHERE is_active = 1
+    ''')
+
+
+# ============================================
+# QUERY PLAN CHECKS
+# ============================================
+
+# Hot queries and the index each one is expected to use
+HOT_QUERIES = [
+    ('SELECT id FROM attendance WHERE session_id = ? AND student_id = ?',
+     (1, 1), 'idx_attendance_session_student'),
+    ('SELECT id FROM sessions WHERE code = ? AND is_active = 1',
+     ('000000',), 'idx_sessions_code_active'),
+    ('SELECT COUNT(*) FROM sessions WHERE class_id = ? AND subject_id = ?',
+     (1, 1), 'idx_sessions_class_subject'),
+    ('SELECT id, class_id FROM students WHERE user_id = ?',
+     (1,), 'idx_students_user'),
+    ('SELECT id, face_encoding FROM students WHERE class_id = ?',
+     (1,), 'idx_students_class'),
+    ('SELECT id FROM teachers WHERE user_id = ?',
+     (1,), 'idx_teachers_user'),
+    ('SELECT subject_id FROM teacher_subjects WHERE teacher_id = ? AND class_id = ?',
+     (1, 1), 'idx_teacher_subjects_teacher'),
+    ('SELECT teacher_id FROM teacher_subjects WHERE class_id = ?',
+     (1,), 'idx_teacher_subjects_class'),
+    ("SELECT id FROM attendance_jobs WHERE status = 'pending' ORDER BY id LIMIT 1",
+     (), 'idx_attendance_jobs_status'),
+    ('SELECT id FROM sessions WHERE is_active = 1 AND expires_at <= ? ORDER BY expires_at LIMIT 100',
+     (0,), 'idx_sessions_active_expiry'),
+]
+
+
+def check_query_plans(conn):
+    """Return (query, plan) pairs for hot queries that do not use their index"""
+    failures = []
+    for query, args, index in HOT_QUERIES:
+        plan = ' | '.join(row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + query, args))
+        if index not in plan:
+            failures.append((query, plan))
+    return failures
@@ -0,0 +1,46 @@
+"""
+Smart Attendance System - Password Hashing
+Hash and verify jobs for the password pool, with rehashing to the configured policy
+
+A policy is a werkzeug method string including its cost, e.g.
+'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'; an empty policy means
+werkzeug's default.
+"""
+
+from functools import lru_cache
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+def hash_password(password, method=None):
+    if method:
+        return generate_password_hash(password, method=method)
+    return generate_password_hash(password)
+
+
+def hash_passwords(passwords, method=None):
+    """Hash a batch of passwords (one pool job for bulk imports)"""
+    return [hash_password(password, method) for password in passwords]
+
+
+@lru_cache(maxsize=None)
+def hash_prefix(method=None):
+    """The 'method:cost' prefix of hashes made with a policy, from a dummy hash.
+
+    werkzeug fills in default costs, so comparing prefixes of real hashes is
+    the only reliable way to tell whether a stored hash matches the policy.
+    """
+    return hash_password('', method).split('$', 1)[0]
+
+
+def verify_password(stored_hash, password, method=None):
+    """Check a password; returns (valid, new_hash).
+
+    new_hash is a fresh hash of the password when the stored one was made
+    with a different method or cost, so the caller can store it; otherwise
+    None. Stronger and weaker policies are both applied this way.
+    """
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] != hash_prefix(method):
+        return True, hash_password(password, method)
+    return True, None
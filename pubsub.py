@@ -0,0 +1,66 @@
+"""
+Smart Attendance System - In-process Publish/Subscribe
+Fan-out of live events (attendance marks, session end) to streaming clients
+"""
+
+import queue
+import threading
+
+
+class Subscription:
+    """A subscriber's private queue of events for one topic"""
+
+    def __init__(self, topic, max_queue):
+        self.topic = topic
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def get(self, timeout):
+        """Return the next event, or None if nothing arrived within timeout"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker:
+    """Routes published events to every current subscriber of a topic.
+
+    Publishing never blocks: a subscriber whose queue is full is flagged as
+    overflowed and is expected to resynchronise from the database.
+    """
+
+    def __init__(self, max_queue=1000):
+        self.max_queue = max_queue
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        subscription = Subscription(topic, self.max_queue)
+        with self._lock:
+            self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.topic]
+
+    def publish(self, topic, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except queue.Full:
+                subscription.overflowed = True
+        return len(subscribers)
+
+    def subscriber_count(self, topic=None):
+        with self._lock:
+            if topic is not None:
+                return len(self._subscribers.get(topic, ()))
+            return sum(len(s) for s in self._subscribers.values())
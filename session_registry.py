@@ -0,0 +1,89 @@
+"""
+Smart Attendance System - Active Session Registry
+In-memory index of running attendance sessions keyed by code and by id
+"""
+
+import time
+import threading
+
+
+class ActiveSessionRegistry:
+    """Active sessions with their class/subject details and expiry time.
+
+    Entries are dicts with at least 'session_id', 'code', 'class_id' and
+    'expires_at' (a Unix timestamp). Lookups ignore expired entries; entries
+    are kept for ``retention`` seconds after expiry so that callers can still
+    accept submissions within a grace period, then purged.
+    """
+
+    def __init__(self, retention=0):
+        self.retention = retention
+        self._by_code = {}
+        self._by_id = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._by_id)
+
+    def add(self, entry):
+        with self._lock:
+            self._purge_expired(time.time())
+            old = self._by_id.pop(entry['session_id'], None)
+            if old is not None and self._by_code.get(old['code']) is old:
+                del self._by_code[old['code']]
+            self._by_code[entry['code']] = entry
+            self._by_id[entry['session_id']] = entry
+
+    def remove(self, session_id):
+        with self._lock:
+            entry = self._by_id.pop(session_id, None)
+            if entry is not None and self._by_code.get(entry['code']) is entry:
+                del self._by_code[entry['code']]
+            return entry
+
+    def expire(self, session_id, at):
+        """Bring a session's expiry forward, e.g. when it is ended early"""
+        with self._lock:
+            entry = self._by_id.get(session_id)
+            if entry is not None:
+                entry['expires_at'] = min(entry['expires_at'], at)
+
+    def by_code(self, code, grace=0):
+        """Return the live session using a code, or None"""
+        with self._lock:
+            return self._live(self._by_code.get(code), grace)
+
+    def by_id(self, session_id, grace=0):
+        """Return a live session by id, or None"""
+        with self._lock:
+            return self._live(self._by_id.get(session_id), grace)
+
+    def ids(self):
+        """Ids of every session held, including expired ones not yet purged"""
+        with self._lock:
+            return list(self._by_id)
+
+    def replace_all(self, entries):
+        """Reset the registry, e.g. from the database at startup"""
+        with self._lock:
+            self._by_code = {entry['code']: entry for entry in entries}
+            self._by_id = {entry['session_id']: entry for entry in entries}
+
+    def purge_expired(self):
+        with self._lock:
+            return self._purge_expired(time.time())
+
+    def _live(self, entry, grace):
+        if entry is None or entry['expires_at'] + grace <= time.time():
+            return None
+        return entry
+
+    def _purge_expired(self, now):
+        expired = [entry for entry in self._by_id.values()
+                   if entry['expires_at'] + self.retention <= now]
+        for entry in expired:
+            del self._by_id[entry['session_id']]
+            if self._by_code.get(entry['code']) is entry:
+                del self._by_code[entry['code']]
+        return len(expired)
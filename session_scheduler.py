@@ -0,0 +1,118 @@
+"""
+Smart Attendance System - Session Scheduler
+Closes attendance sessions on the server once they expire
+
+Sessions used to end only when the teacher's page called the end endpoint,
+so a closed tab left them running forever. Every web process now runs a
+scheduler thread that closes sessions whose expiry (plus the submission
+grace period) has passed, in batches found through the partial index on
+running sessions. Closing is conditional on the session still running, so
+when several processes (or the teacher) race to close the same session the
+end-of-session hooks run exactly once.
+
+The functions that change sessions run inside a write transaction opened by
+the caller and do not commit.
+"""
+
+import logging
+import threading
+import time
+from summaries import session_ended
+
+logger = logging.getLogger(__name__)
+
+
+def expired_sessions(conn, before, limit):
+    """Ids of running sessions that expired before ``before``, oldest first (read-only)"""
+    return [row[0] for row in conn.execute('''
+        SELECT id FROM sessions WHERE is_active = 1 AND expires_at <= ?
+        ORDER BY expires_at LIMIT ?
+    ''', (before, limit))]
+
+
+def ended_sessions(conn, session_ids):
+    """Which of these sessions are no longer running (read-only)"""
+    session_ids = list(session_ids)
+    if not session_ids:
+        return []
+    placeholders = ', '.join('?' * len(session_ids))
+    return [row[0] for row in conn.execute(
+        f'SELECT id FROM sessions WHERE is_active = 0 AND id IN ({placeholders})', session_ids)]
+
+
+def close_sessions(conn, session_ids):
+    """End sessions that are still running; returns the ids this call ended.
+
+    A session ended early expires now, so photos already on their way are
+    still accepted for the grace period.
+    """
+    now = time.time()
+    closed = []
+    for session_id in session_ids:
+        cursor = conn.execute('''
+            UPDATE sessions
+            SET is_active = 0, end_time = CURRENT_TIMESTAMP, expires_at = MIN(expires_at, ?)
+            WHERE id = ? AND is_active = 1
+        ''', (now, session_id))
+        if cursor.rowcount:
+            session_ended(conn, session_id)
+            closed.append(session_id)
+    return closed
+
+
+class SessionScheduler:
+    """A thread closing expired sessions every ``interval`` seconds.
+
+    ``write(fn, *args)`` applies close_sessions in a transaction and returns
+    its result. ``on_closed(session_ids)`` runs the in-process end hooks
+    (registry, live streams) for sessions this process closed, and for
+    sessions from ``held()`` (ids this process has cached) that another
+    process has closed meanwhile.
+    """
+
+    def __init__(self, connect, write, on_closed, held=None, grace=0, interval=1.0, batch_size=100):
+        self.connect = connect
+        self.write = write
+        self.on_closed = on_closed
+        self.held = held
+        self.grace = grace
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        """Start this process's scheduler thread (once)"""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._worker, name='session-scheduler', daemon=True).start()
+
+    def run_once(self, conn):
+        """Close every session that has expired; returns how many this call closed"""
+        before = time.time() - self.grace
+        total = 0
+        while True:
+            session_ids = expired_sessions(conn, before, self.batch_size)
+            if session_ids:
+                closed = self.write(close_sessions, session_ids)
+                if closed:
+                    total += len(closed)
+                    self.on_closed(closed)
+            if len(session_ids) < self.batch_size:
+                break
+        if self.held is not None:
+            stale = ended_sessions(conn, self.held())
+            if stale:
+                self.on_closed(stale)
+        return total
+
+    def _worker(self):
+        conn = self.connect()
+        while True:
+            try:
+                self.run_once(conn)
+            except Exception:
+                logger.exception('Session scheduler error')
+            time.sleep(self.interval)
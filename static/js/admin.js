@@ -167,6 +167,41 @@ async function addClass(e) {
     }
 }
 
+async function bulkImport(e) {
+    e.preventDefault();
+    const formData = new FormData(e.target);
+    const submitBtn = e.target.querySelector('button[type="submit"]');
+    submitBtn.disabled = true;
+    try {
+        const response = await fetch('/api/admin/import', {
+            method: 'POST',
+            headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') },
+            body: formData
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            alert(data.message || 'Import failed');
+            return;
+        }
+        const result = data[formData.get('kind')];
+        let message = `Created ${result.created} ${formData.get('kind')}`;
+        if (result.assigned !== undefined) message += `, ${result.assigned} subject assignments`;
+        if (result.errors.length) {
+            message += `\n\n${result.errors.length} rows skipped:\n` + result.errors.slice(0, 20)
+                .map(error => `Row ${error.row} (${error.email || '-'}): ${error.message}`).join('\n');
+        }
+        alert(message);
+        closeModal('importModal');
+        e.target.reset();
+        loadClasses();
+        loadDashboardData();
+    } catch (error) {
+        console.error('Error:', error);
+    } finally {
+        submitBtn.disabled = false;
+    }
+}
+
 async function updateClass(e) {
     e.preventDefault();
     const id = document.getElementById('editClassId').value;
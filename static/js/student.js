@@ -1,6 +1,8 @@
 let studentData = null;
 let currentStream = null;
 let currentSessionData = null;
+// Stop waiting for a queued attendance check after this long
+const ATTENDANCE_JOB_TIMEOUT_MS = 3 * 60 * 1000;
 
 function toggleSidebar() {
     document.querySelector('.sidebar').classList.toggle('active');
@@ -106,23 +108,32 @@ function stopCamera() {
     document.getElementById('startCameraBtn').style.display = 'block';
 }
 
-async function captureFace() {
-    const video = document.getElementById('cameraFeed');
+// Grab the current video frame as a JPEG blob, uploaded as the raw request
+// body (smaller and cheaper to decode than a base64 data URL in JSON)
+function captureJpeg(video) {
     const canvas = document.createElement('canvas');
     canvas.width = video.videoWidth;
     canvas.height = video.videoHeight;
     canvas.getContext('2d').drawImage(video, 0, 0);
     
-    const imageData = canvas.toDataURL('image/jpeg');
+    return new Promise((resolve, reject) => {
+        canvas.toBlob(blob => blob ? resolve(blob) : reject(new Error('Could not capture image')),
+                      'image/jpeg', 0.92);
+    });
+}
+
+async function captureFace() {
+    const video = document.getElementById('cameraFeed');
 
     try {
+        const image = await captureJpeg(video);
         const response = await fetch('/api/student/register-face', {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json',
+                'Content-Type': 'image/jpeg',
                 'Authorization': 'Bearer ' + localStorage.getItem('token')
             },
-            body: JSON.stringify({ image: imageData })
+            body: image
         });
 
         const result = await response.json();
@@ -189,29 +200,31 @@ async function markAttendance() {
     if (!currentSessionData) return;
 
     const video = document.getElementById('attendanceCamera');
-    const canvas = document.createElement('canvas');
-    canvas.width = video.videoWidth;
-    canvas.height = video.videoHeight;
-    canvas.getContext('2d').drawImage(video, 0, 0);
-    
-    const imageData = canvas.toDataURL('image/jpeg');
 
     try {
-        const response = await fetch('/api/student/mark-attendance', {
+        const image = await captureJpeg(video);
+        const params = new URLSearchParams({ session_id: currentSessionData.session_id });
+        const response = await fetch('/api/student/mark-attendance?' + params, {
             method: 'POST',
             headers: {
-                'Content-Type': 'application/json',
-                'Authorization': 'Bearer ' + localStorage.getItem('token')
+                'Content-Type': 'image/jpeg',
+                'Authorization': 'Bearer ' + localStorage.getItem('token'),
+                // Verified in the background; the photo counts as submitted now
+                'Prefer': 'respond-async'
             },
-            body: JSON.stringify({ 
-                session_id: currentSessionData.session_id,
-                image: imageData 
-            })
+            body: image
         });
 
-        const result = await response.json();
+        let result = await response.json();
+        let ok = response.ok;
 
-        if (response.ok) {
+        if (response.status === 202) {
+            showAlert('info', 'Photo received, verifying...');
+            result = await waitForAttendanceJob(result.status_url);
+            ok = result.status_code === 200;
+        }
+
+        if (ok) {
             showAlert('success', 'Attendance marked!');
             setTimeout(() => cancelAttendance(), 2000);
         } else {
@@ -222,6 +235,24 @@ async function markAttendance() {
     }
 }
 
+async function waitForAttendanceJob(url) {
+    const deadline = Date.now() + ATTENDANCE_JOB_TIMEOUT_MS;
+    for (let delay = 500; Date.now() < deadline; delay = Math.min(delay * 1.5, 3000)) {
+        await new Promise(resolve => setTimeout(resolve, delay));
+        const response = await fetch(url, {
+            headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') }
+        });
+        const job = await response.json();
+        if (!response.ok || job.status === 'done') {
+            return response.ok ? job : { status_code: response.status, message: job.message };
+        }
+    }
+    return {
+        status_code: 504,
+        message: 'Verification is taking too long. Check your attendance report later or try again.'
+    };
+}
+
 function cancelAttendance() {
     stopAllCameras();
     document.getElementById('codeInputSection').style.display = 'block';
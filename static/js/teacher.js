@@ -3,6 +3,10 @@ let currentSession = null;
 let sessionTimer = null;
 let timeRemaining = 60;
 let reportData = null;
+let attendanceStream = null;
+let attendanceCursor = 0;
+let shownAttendanceIds = new Set();
+let presentStudents = [];
 
 function toggleSidebar() {
     document.querySelector('.sidebar').classList.toggle('active');
@@ -125,16 +129,16 @@ async function startSession() {
         document.getElementById('activeSessionInfo').textContent = 
             `${currentSession.class_name} - ${currentSession.subject_name}`;
 
-        startTimer();
-        pollAttendance();
+        startTimer(currentSession.duration);
+        watchAttendance();
     } catch (error) {
         console.error('Error:', error);
         alert('Failed to start session');
     }
 }
 
-function startTimer() {
-    timeRemaining = 60;
+function startTimer(duration) {
+    timeRemaining = duration || 60;
     updateTimerDisplay();
     
     sessionTimer = setInterval(() => {
@@ -151,35 +155,111 @@ function updateTimerDisplay() {
     document.getElementById('timer').textContent = `⏱ ${timeRemaining}s remaining`;
 }
 
+function renderPresentStudents() {
+    const list = document.getElementById('presentStudents');
+    if (presentStudents.length === 0) {
+        list.innerHTML = '<div class="empty-state"><i class="fas fa-users"></i><p>Waiting for students...</p></div>';
+        return;
+    }
+
+    list.innerHTML = '';
+    presentStudents.forEach(student => {
+        list.innerHTML += `
+            <div class="student-item">
+                <div class="student-avatar">${student.name[0]}</div>
+                <div class="student-info">
+                    <h4>${student.name}</h4>
+                    <p>${student.email}</p>
+                </div>
+                <span class="status-badge present">
+                    <i class="fas fa-check"></i> Present
+                </span>
+            </div>
+        `;
+    });
+}
+
+function addAttendanceRows(rows) {
+    // Skip by id, not by cursor: a row may arrive after one with a higher id
+    const fresh = rows.filter(row => !shownAttendanceIds.has(row.id));
+    if (fresh.length === 0) return;
+
+    fresh.forEach(row => {
+        shownAttendanceIds.add(row.id);
+        presentStudents.unshift(row);
+    });
+    attendanceCursor = Math.max(attendanceCursor, ...fresh.map(row => row.id));
+    renderPresentStudents();
+}
+
+function watchAttendance() {
+    presentStudents = [];
+    attendanceCursor = 0;
+    shownAttendanceIds = new Set();
+    renderPresentStudents();
+
+    if (!window.EventSource) {
+        pollAttendance();
+        return;
+    }
+
+    openAttendanceStream();
+}
+
+async function openAttendanceStream() {
+    if (!currentSession) return;
+    const sessionId = currentSession.id;
+
+    try {
+        // EventSource cannot send the Authorization header: the URL carries a
+        // short-lived ticket for this session's stream instead of the token
+        const response = await fetch(`/api/teacher/session/${sessionId}/attendance/stream-ticket`, {
+            method: 'POST',
+            headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') }
+        });
+        if (!response.ok) throw new Error('No stream ticket');
+        const { ticket } = await response.json();
+        if (!currentSession || currentSession.id !== sessionId) return;
+
+        attendanceStream = new EventSource(`/api/teacher/session/${sessionId}/attendance/stream` +
+            `?ticket=${encodeURIComponent(ticket)}&since=${attendanceCursor}`);
+        attendanceStream.addEventListener('attendance', event => {
+            addAttendanceRows([JSON.parse(event.data)]);
+        });
+        attendanceStream.addEventListener('end', stopAttendanceStream);
+        // The stream reached its maximum lifetime: open a new one with a new ticket
+        attendanceStream.addEventListener('reconnect', () => {
+            stopAttendanceStream();
+            openAttendanceStream();
+        });
+        attendanceStream.onerror = () => {
+            // Refused (server busy, ticket expired): the browser will not retry, so poll
+            if (attendanceStream && attendanceStream.readyState === EventSource.CLOSED) {
+                stopAttendanceStream();
+                pollAttendance();
+            }
+        };
+    } catch (error) {
+        console.error('Error:', error);
+        pollAttendance();
+    }
+}
+
+function stopAttendanceStream() {
+    if (attendanceStream) {
+        attendanceStream.close();
+        attendanceStream = null;
+    }
+}
+
 async function pollAttendance() {
     if (!currentSession) return;
 
     try {
-        const response = await fetch(`/api/teacher/session/${currentSession.id}/attendance`, {
+        const response = await fetch(`/api/teacher/session/${currentSession.id}/attendance?since=${attendanceCursor}`, {
             headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') }
         });
-        const students = await response.json();
-        
-        const list = document.getElementById('presentStudents');
-        if (students.length === 0) {
-            list.innerHTML = '<div class="empty-state"><i class="fas fa-users"></i><p>Waiting for students...</p></div>';
-        } else {
-            list.innerHTML = '';
-            students.forEach(student => {
-                list.innerHTML += `
-                    <div class="student-item">
-                        <div class="student-avatar">${student.name[0]}</div>
-                        <div class="student-info">
-                            <h4>${student.name}</h4>
-                            <p>${student.email}</p>
-                        </div>
-                        <span class="status-badge present">
-                            <i class="fas fa-check"></i> Present
-                        </span>
-                    </div>
-                `;
-            });
-        }
+        addAttendanceRows(await response.json());
 
         if (currentSession) {
             setTimeout(pollAttendance, 2000);
@@ -189,6 +269,49 @@ async function pollAttendance() {
     }
 }
 
+function readFileAsDataURL(file) {
+    return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result);
+        reader.onerror = () => reject(reader.error);
+        reader.readAsDataURL(file);
+    });
+}
+
+async function uploadGroupPhoto() {
+    if (!currentSession) return;
+
+    const input = document.getElementById('groupPhotoInput');
+    if (input.files.length === 0) {
+        alert('Please choose a classroom photo');
+        return;
+    }
+
+    try {
+        const images = await Promise.all([...input.files].map(readFileAsDataURL));
+        const response = await fetch(`/api/teacher/session/${currentSession.id}/group-photo`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': 'Bearer ' + localStorage.getItem('token')
+            },
+            body: JSON.stringify({ images })
+        });
+        const result = await response.json();
+
+        if (response.ok) {
+            input.value = '';
+            alert(`${result.faces} faces found: ${result.marked} marked present, ` +
+                  `${result.ambiguous.length} ambiguous, ${result.unmatched.length} unrecognized`);
+        } else {
+            alert(result.message || 'Failed to process photo');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+        alert('Failed to process photo');
+    }
+}
+
 async function endSession() {
     if (!currentSession) return;
 
@@ -199,6 +322,7 @@ async function endSession() {
         });
 
         clearInterval(sessionTimer);
+        stopAttendanceStream();
         currentSession = null;
         
         document.getElementById('startSessionForm').style.display = 'block';
@@ -249,6 +373,33 @@ async function loadReportSubjects() {
     }
 }
 
+// Fetch every page of the matrix report and expand it into one record per student and session
+async function fetchReportRecords(classId, subjectId) {
+    const records = [];
+    let offset = 0;
+    while (true) {
+        const response = await fetch(`/api/teacher/report?class_id=${classId}&subject_id=${subjectId}&format=matrix&offset=${offset}`, {
+            headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') }
+        });
+        const page = await response.json();
+        page.sessions.forEach(session => {
+            const bits = atob(session.present);
+            page.students.forEach((student, i) => {
+                const present = (bits.charCodeAt(i >> 3) >> (i & 7)) & 1;
+                records.push({
+                    date: session.date,
+                    student_name: student.name,
+                    status: present ? 'present' : 'absent'
+                });
+            });
+        });
+
+        offset += page.sessions.length;
+        if (page.sessions.length === 0 || offset >= page.total_sessions) break;
+    }
+    return records;
+}
+
 async function loadAttendanceReport() {
     const classId = document.getElementById('reportClass').value;
     const subjectId = document.getElementById('reportSubject').value;
@@ -256,10 +407,7 @@ async function loadAttendanceReport() {
     if (!classId || !subjectId) return;
 
     try {
-        const response = await fetch(`/api/teacher/report?class_id=${classId}&subject_id=${subjectId}`, {
-            headers: { 'Authorization': 'Bearer ' + localStorage.getItem('token') }
-        });
-        reportData = await response.json();
+        reportData = { records: await fetchReportRecords(classId, subjectId) };
         
         document.getElementById('attendanceReport').style.display = 'block';
         
@@ -0,0 +1,105 @@
+"""
+Smart Attendance System - Attendance Summaries
+Counters behind the reports, updated in the same transaction as the rows they summarise
+
+    class_subject_stats    sessions held per (class, subject)
+    student_subject_stats  present marks and last attendance per (student, subject)
+    session_stats          present marks per session
+
+Row counts for the admin dashboard (entity_counts, classes.student_count)
+are kept by triggers instead, so cascading deletes are counted too.
+"""
+
+# Tables whose row counts are kept in entity_counts
+COUNTED_TABLES = ('classes', 'students', 'teachers', 'subjects')
+
+
+def session_started(conn, session_id, class_id, subject_id):
+    conn.execute('''
+        INSERT INTO class_subject_stats (class_id, subject_id, sessions_held)
+        VALUES (?, ?, 1)
+        ON CONFLICT (class_id, subject_id) DO UPDATE SET sessions_held = sessions_held + 1
+    ''', (class_id, subject_id))
+    conn.execute('''
+        INSERT OR IGNORE INTO session_stats (session_id, class_id, subject_id, present_count)
+        VALUES (?, ?, ?, 0)
+    ''', (session_id, class_id, subject_id))
+
+
+def attendance_marked(conn, session_id, subject_id, student_ids):
+    """Count newly inserted attendance rows; pass only rows that were really added"""
+    if not student_ids:
+        return
+    conn.executemany('''
+        INSERT INTO student_subject_stats (student_id, subject_id, present_count, last_attended_at)
+        VALUES (?, ?, 1, CURRENT_TIMESTAMP)
+        ON CONFLICT (student_id, subject_id) DO UPDATE
+        SET present_count = present_count + 1, last_attended_at = CURRENT_TIMESTAMP
+    ''', [(student_id, subject_id) for student_id in student_ids])
+    conn.execute('''
+        UPDATE session_stats SET present_count = present_count + ?
+        WHERE session_id = ?
+    ''', (len(student_ids), session_id))
+
+
+def session_ended(conn, session_id):
+    """Settle the session's count from its attendance rows once no more marks can arrive"""
+    conn.execute('''
+        INSERT INTO session_stats (session_id, class_id, subject_id, present_count)
+        SELECT s.id, s.class_id, s.subject_id,
+               (SELECT COUNT(*) FROM attendance WHERE session_id = s.id)
+        FROM sessions s WHERE s.id = ?
+        ON CONFLICT (session_id) DO UPDATE SET present_count = excluded.present_count
+    ''', (session_id,))
+
+
+def student_removed(conn, student_id):
+    """Take a student's marks out of the session counts before the student is deleted.
+
+    Their own per-subject rows go with the student through ON DELETE CASCADE.
+    """
+    conn.execute('''
+        UPDATE session_stats SET present_count = present_count - 1
+        WHERE session_id IN (SELECT session_id FROM attendance WHERE student_id = ?)
+    ''', (student_id,))
+
+
+def rebuild_summaries(conn):
+    """Recompute every summary table from sessions and attendance; caller commits"""
+    conn.execute('DELETE FROM class_subject_stats')
+    conn.execute('DELETE FROM student_subject_stats')
+    conn.execute('DELETE FROM session_stats')
+    conn.execute('''
+        INSERT INTO class_subject_stats (class_id, subject_id, sessions_held)
+        SELECT class_id, subject_id, COUNT(*)
+        FROM sessions
+        GROUP BY class_id, subject_id
+    ''')
+    conn.execute('''
+        INSERT INTO student_subject_stats (student_id, subject_id, present_count, last_attended_at)
+        SELECT a.student_id, s.subject_id, COUNT(*), MAX(a.marked_at)
+        FROM attendance a
+        JOIN sessions s ON a.session_id = s.id
+        GROUP BY a.student_id, s.subject_id
+    ''')
+    conn.execute('''
+        INSERT INTO session_stats (session_id, class_id, subject_id, present_count)
+        SELECT s.id, s.class_id, s.subject_id, COUNT(a.id)
+        FROM sessions s
+        LEFT JOIN attendance a ON a.session_id = s.id
+        GROUP BY s.id
+    ''')
+
+
+def rebuild_entity_counts(conn):
+    """Recompute entity_counts and classes.student_count; caller commits"""
+    for table in COUNTED_TABLES:
+        conn.execute(f'''
+            INSERT INTO entity_counts (entity, count) VALUES ('{table}', (SELECT COUNT(*) FROM {table}))
+            ON CONFLICT (entity) DO UPDATE SET count = excluded.count
+        ''')
+    conn.execute('''
+        UPDATE classes SET student_count = (
+            SELECT COUNT(*) FROM students WHERE students.class_id = classes.id
+        )
+    ''')
@@ -0,0 +1,126 @@
+"""
+Smart Attendance System - Bounded Worker Pools
+Process pools with a bounded queue, backpressure and per-job timeouts
+"""
+
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class PoolBusyError(Exception):
+    """Raised when a pool already has its maximum number of queued jobs"""
+
+    def __init__(self, retry_after):
+        super().__init__('Server is busy, please retry shortly')
+        self.retry_after = retry_after
+
+
+class JobTimeoutError(Exception):
+    """Raised when a job does not finish within the pool's timeout"""
+
+
+def _ready():
+    return os.getpid()
+
+
+class BoundedProcessPool:
+    """Process pool that rejects work instead of queueing it without limit.
+
+    At most ``max_workers + max_queue`` jobs are admitted at once; further
+    submissions raise PoolBusyError so callers can answer with a 503.
+    The executor is created lazily and re-created after a fork, so the pool
+    is safe to construct at import time under gunicorn.
+
+    With the 'forkserver' start method, ``preload`` names modules the fork
+    server imports once; every worker forked from it shares their memory.
+    """
+
+    def __init__(self, max_workers=None, max_queue=None, timeout=30,
+                 retry_after=2, start_method='spawn', initializer=None, preload=()):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = self.max_workers * 2 if max_queue is None else max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.start_method = start_method
+        self.initializer = initializer
+        self.preload = list(preload)
+
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self._pending = 0
+
+    @property
+    def pending(self):
+        """Number of admitted jobs that are queued or running"""
+        return self._pending
+
+    def _get_executor(self):
+        with self._lock:
+            # A crashed worker leaves the executor broken; start a fresh one
+            broken = self._executor is not None and getattr(self._executor, '_broken', False)
+            if self._executor is None or self._pid != os.getpid() or broken:
+                context = multiprocessing.get_context(self.start_method)
+                if self.start_method == 'forkserver' and self.preload:
+                    context.set_forkserver_preload(self.preload)
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=self.initializer
+                )
+                self._pid = os.getpid()
+            return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args, **kwargs):
+        """Submit a job without blocking, raising PoolBusyError when full"""
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError(self.retry_after)
+
+        with self._lock:
+            self._pending += 1
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+
+        # The slot is held until the job really finishes, even if the caller
+        # gave up waiting, so timed-out jobs still count against the queue.
+        future.add_done_callback(self._release)
+        return future
+
+    def result(self, future, timeout=None):
+        """Wait for a submitted job, raising JobTimeoutError on timeout"""
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise JobTimeoutError('Processing took too long, please try again')
+
+    def run(self, fn, *args, **kwargs):
+        """Submit a job and wait for its result"""
+        return self.result(self.submit(fn, *args, **kwargs))
+
+    def start(self):
+        """Launch the worker processes now instead of on the first jobs.
+
+        Returns the number of distinct workers that answered; each one has
+        run the initializer by then.
+        """
+        futures = [self.submit(_ready) for _ in range(self.max_workers)]
+        return len({self.result(future) for future in futures})
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
+            self._pid = None